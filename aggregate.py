@@ -0,0 +1,207 @@
+# aggregate.py
+# Summaries of browser history for the charts, worked out in a few whole-array NumPy operations rather than one
+# visit or one domain at a time.
+import collections
+import collections.abc
+import operator
+import numpy as np
+import browserhandler
+import visittable
+
+# Columns of a VisitTable that may be used as a chart category, by category name
+CATEGORY_COLUMNS = {'counter': 'counters', 'time': 'times', 'duration': 'durations'}
+
+# Categories worked out from the visits' times rather than stored (see sessionize)
+SESSION_CATEGORIES = ['duration', 'sessions']
+
+# A pause of more than this many seconds between visits ends a browsing session
+IDLE_GAP = 30 * 60
+
+# The longest time, in seconds, that one visit is taken to have lasted
+DWELL_CAP = 10 * 60
+
+def count_visits(sites):
+    # Returns a Counter of visits per domain.
+    # sites may be the usual {domain: visits} mapping (including a VisitTable), a stream of batches of normalized
+    # visit rows such as browserhandler's iter_visits() produces, or a Counter that this or a browser's
+    # count_domains() has already returned. In the latter case, visits to domains below the threshold may already
+    # have been added up under browserhandler.EVERYTHING_ELSE.
+    # 10/17/26: a stream is counted one batch at a time as it goes past, so memory use depends on the number of
+    # domains rather than the number of visits.
+    if isinstance(sites, collections.Counter):
+        return sites
+
+    counts = collections.Counter()
+    if isinstance(sites, collections.abc.Mapping):
+        for i in sites:
+            counts[i] = len(sites[i])
+        return counts
+
+    for batch in sites:
+        counts.update(map(operator.itemgetter(1), batch))  # index 1 of a normalized row is the domain
+    return counts
+
+# NumPy types matching each array typecode used by VisitTable
+DTYPES = {'q': np.int64, 'i': np.int32, 'd': np.float64}
+
+# A VisitTable's per-visit columns
+VISIT_COLUMNS = ['visit_ids', 'domain_ids', 'url_ids', 'title_ids', 'times', 'counters', 'durations', 'source_ids']
+
+def column(values, dtype):
+    # A NumPy view of one of a VisitTable's columns, without copying it. The table cannot grow while the view is
+    # alive, so anything kept around should be derived from it (e.g. by indexing) rather than be the view itself.
+    if len(values) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.frombuffer(values, dtype=dtype)
+
+def domain_counts(sites):
+    # Returns (labels, counts): an array of domain names and a matching array of the number of visits to each.
+    if isinstance(sites, visittable.VisitTable):
+        return np.array(sites.domains.values, dtype=object), column(sites.domain_counts, np.int64).copy()
+
+    counts = count_visits(sites)
+    return np.array(list(counts.keys()), dtype=object), np.fromiter(counts.values(), dtype=np.int64, count=len(counts))
+
+def select_rows(table, mask=None):
+    # A copy of a VisitTable holding only the visits for which mask (an array of booleans, one per visit) is true, or
+    # every visit if there is no mask. The copy can be read while the original carries on growing: it has a pool of
+    # domains of its own, and shares the URL and title pools, to which strings are only ever added.
+    subset = visittable.VisitTable()
+    for i in VISIT_COLUMNS:
+        values = getattr(table, i)
+        picked = column(values, DTYPES[values.typecode])
+        if mask is not None:
+            picked = picked[mask]
+        getattr(subset, i).frombytes(picked.tobytes())
+
+    subset.domains = table.domains.copy()
+    subset.urls = table.urls
+    subset.titles = table.titles
+    counts = np.bincount(column(subset.domain_ids, np.int32), minlength=len(subset.domains))
+    subset.domain_counts.frombytes(counts.astype(np.int64).tobytes())
+    if subset.row_count() > 0:
+        subset.maximum_counter = int(column(subset.counters, np.int64).max())
+        subset.maximum_duration = int(column(subset.durations, np.int64).max())
+    return subset
+
+def rollup(labels, counts, th=0):
+    # Split domains into those with at least th visits, which keep their own entry, and the rest, which are added up
+    # into browserhandler.EVERYTHING_ELSE at the end. Visits without a domain, and domains without visits (as a
+    # selection of a VisitTable's rows may have), are left out altogether.
+    # Returns (labels, counts) for the chart.
+    missing = np.equal(labels, None) | (counts == 0)
+    below = ~missing & ((counts < th) | np.equal(labels, browserhandler.EVERYTHING_ELSE))
+    keep = ~missing & ~below
+
+    kuiper_belt = counts[below].sum()
+    if kuiper_belt > 0:
+        return (np.append(labels[keep], browserhandler.EVERYTHING_ELSE),
+                np.append(counts[keep], kuiper_belt))
+    return labels[keep], counts[keep]
+
+def visit_columns(sites, categories, idle_gap=IDLE_GAP, dwell_cap=DWELL_CAP):
+    # Returns (domain_ids, labels, {category: values}) covering every visit in sites, one array element per visit.
+    # A VisitTable's columns are used as they are; anything else is copied into arrays once.
+    # 10/17/26: a duration of 0 means the browser did not record one (only Chrome-based browsers do); those are
+    # estimated from the visits' times, as is the "sessions" category (see sessionize). Each source's visits (a
+    # VisitTable's source_ids) are taken as a timeline of their own. sites should hold every visit in the time window,
+    # as the estimates depend on the visits around each one, so any threshold is best applied afterwards.
+    stored = [i for i in categories if i in CATEGORY_COLUMNS]
+    if any(i in SESSION_CATEGORIES for i in categories) and 'time' not in stored:
+        stored.append('time')
+
+    if isinstance(sites, visittable.VisitTable):
+        values = {}
+        for i in stored:
+            array = getattr(sites, CATEGORY_COLUMNS[i])
+            values[i] = column(array, np.float64 if array.typecode == 'd' else np.int64)
+        domain_ids, labels = column(sites.domain_ids, np.int32), np.array(sites.domains.values, dtype=object)
+        sources = column(sites.source_ids, np.int32)
+    else:
+        sources = None
+        labels = list(sites)
+        domain_ids = np.repeat(np.arange(len(labels), dtype=np.int32), [len(sites[i]) for i in labels])
+        values = {}
+        for i in stored:
+            values[i] = np.fromiter((getattr(j, i) for domain in labels for j in sites[domain]), dtype=np.float64,
+                                    count=len(domain_ids))
+        labels = np.array(labels, dtype=object)
+
+    if any(i in SESSION_CATEGORIES for i in categories):
+        dwell, session_ids = sessionize(values['time'], idle_gap, dwell_cap, sources)
+        if 'duration' in categories:
+            # Durations are in microseconds, as Chrome records them
+            values['duration'] = np.where(values['duration'] > 0, values['duration'], dwell * 1_000_000)
+        if 'sessions' in categories:
+            values['sessions'] = session_counts(domain_ids, session_ids)[domain_ids]
+
+    return domain_ids, labels, {i: values[i] for i in categories}
+
+def sessionize(times, idle_gap=IDLE_GAP, dwell_cap=DWELL_CAP, sources=None):
+    # Split visits into browsing sessions and estimate how long each visit lasted, for every visit at once.
+    # Visits are put in order of time (the only O(n log n) step); a visit lasts until the next one, up to dwell_cap
+    # seconds, unless more than idle_gap seconds pass first, in which case a new session begins and the visit's
+    # length is unknown (0), as is that of the very last visit.
+    # With sources (an array of numbers, one per visit), the visits of each source are ordered and split separately,
+    # as each is a timeline of its own: two browsers' visits are not one browsing session.
+    # Returns (dwell, session_ids): seconds, and the number of each visit's session counting from 0, both in the
+    # visits' original order.
+    order = np.argsort(times, kind='stable') if sources is None else np.lexsort((times, sources))
+    gaps = np.diff(times[order])
+    within = gaps <= idle_gap
+    if sources is not None:
+        within &= np.diff(sources[order]) == 0
+
+    dwell = np.zeros(len(times))
+    dwell[order[:-1]] = np.where(within, np.minimum(gaps, dwell_cap), 0)
+
+    session_ids = np.empty(len(times), dtype=np.int64)
+    session_ids[order] = np.concatenate(([0], np.cumsum(~within))) if len(times) else []
+    return dwell, session_ids
+
+def session_counts(domain_ids, session_ids):
+    # The number of distinct sessions in which each domain was visited, indexed by domain ID
+    if len(domain_ids) == 0:
+        return np.zeros(0, dtype=np.int64)
+    sessions = int(session_ids.max()) + 1
+    pairs = np.unique(domain_ids.astype(np.int64) * sessions + session_ids)
+    return np.bincount(pairs // sessions, minlength=int(domain_ids.max()) + 1)
+
+def stratified_sample(domain_ids, budget, seed=0):
+    # Choose at most budget visits (about that many, since every domain keeps at least one) such that each domain
+    # keeps the same share of the visits as it had before. Which of a domain's visits are kept is random, but the
+    # same from one run to the next. Returns the positions of the chosen visits, in their original order.
+    # This is done for every domain at once: shuffle by sorting on random keys within each domain, then keep the
+    # visits whose place in that order falls under their domain's quota.
+    total = len(domain_ids)
+    if total <= budget:
+        return np.arange(total)
+
+    sizes = np.bincount(domain_ids)
+    quotas = np.maximum(np.floor(sizes * (budget / total)), np.minimum(sizes, 1)).astype(np.int64)
+
+    keys = np.random.default_rng(seed).random(total)
+    order = np.lexsort((keys, domain_ids))
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    ranks = np.arange(total) - starts[domain_ids[order]]
+    return np.sort(order[ranks < quotas[domain_ids[order]]])
+
+def time_buckets(sites, width=86400, by_domain=False):
+    # Count visits in consecutive buckets of width seconds, starting from the bucket holding the earliest visit.
+    # Returns (starts, counts): the Safari time at which each bucket begins, and the number of visits in each; with
+    # by_domain, counts has one row per domain (in the order of sites' domains) and one column per bucket.
+    domain_ids, labels, values = visit_columns(sites, ['time'])
+    times = values['time']
+    if len(times) == 0:
+        return np.zeros(0), np.zeros((len(labels), 0) if by_domain else 0, dtype=np.int64)
+
+    first = (times.min() // width) * width
+    buckets = ((times - first) // width).astype(np.int64)
+    size = int(buckets.max()) + 1
+    starts = first + np.arange(size) * width
+    if not by_domain:
+        return starts, np.bincount(buckets, minlength=size)
+
+    # One bincount over (domain, bucket) pairs, rather than one per domain
+    cells = domain_ids.astype(np.int64) * size + buckets
+    return starts, np.bincount(cells, minlength=len(labels) * size).reshape(len(labels), size)
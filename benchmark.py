@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+# benchmark.py
+# Measures how quickly HistoryLane reads each browser's history and draws each chart, using made-up histories of any
+# size in databases laid out like the real ones.
+#
+# 10/17/26: for each browser and each size asked for, a fixture database is generated (and kept, so later runs can
+# reuse it), then each benchmark is run against it and timed. Peak memory is measured with tracemalloc in a
+# separate run of the same benchmark, since tracing every allocation slows things down too much for the times to
+# mean anything; memory that SQLite allocates for itself is not seen by tracemalloc, so is not included. SQL
+# statements are counted with sqlite3's trace callback (each row of an executemany() counts as one). Results are
+# written out as JSON; give an earlier results file to --compare to see what has got faster or slower since.
+import argparse
+import datetime
+import gc
+import itertools
+import json
+import os
+import platform
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+import browserhandler
+import chartgen
+import heavyhitters
+import historycache
+import visittable
+
+BROWSERS = ['safari', 'firefox', 'vivaldi', 'chrome']
+BENCHMARKS = ['iter_visits', 'count_domains', 'top_k_count', 'load', 'cache_update', 'cached_count', 'cached_search',
+              'piechart', 'barchart', 'scatterplot']
+FIXTURE_DIR = os.path.join(tempfile.gettempdir(), 'historylane-benchmark')
+SIZE_SUFFIXES = {'k': 1_000, 'm': 1_000_000}
+
+# Rows written to a fixture database per executemany() call
+FIXTURE_BATCH = 50_000
+
+# Counters kept by the top_k_count benchmark, as with historylane.py --top-k 1000
+TOP_K = 1000
+
+# Visits held the old way, as {domain: [VisitContainer, ...]}, when comparing that with a VisitTable's memory use
+# (see memory_per_visit). The old way costs about the same per visit however many there are, and millions of
+# visits would take gigabytes.
+CONTAINER_SAMPLE = 100_000
+
+# Made-up histories span this long, ending now
+FIXTURE_SPAN = 365 * 86400
+
+# Kinds of host the made-up histories visit, so that the domain code sees something like the real mix
+HOST_PATTERNS = ['www.site%d.com', 'site%d.org', 'news.site%d.co.uk', 'user%d.github.io', 'docs.site%d.net',
+                 'site%d.de', 'mail.site%d.com', '10.0.%d.1:8080']
+
+def parse_size(text):
+    # A number of visits, e.g. 250000, 10k or 1.5M
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([kKmM]?)', text.strip())
+    if match is None:
+        raise argparse.ArgumentTypeError('%s is not a number of visits such as 10000, 10k or 1M' % text)
+    return int(float(match.group(1)) * SIZE_SUFFIXES.get(match.group(2).lower(), 1))
+
+def synthetic_history(visits, seed=0):
+    # Returns (urls, visits): a list of (url, host, title) and a generator of (url index, Unix time, duration in
+    # microseconds) in the order a browser would have recorded them. How often each site is visited follows
+    # Zipf's law, as real browsing does: a few sites account for most visits.
+    rng = random.Random(seed)
+    hosts = [HOST_PATTERNS[i % len(HOST_PATTERNS)] % i for i in range(max(20, visits // 500))]
+    urls = []
+    for i in range(max(100, visits // 8)):
+        host = hosts[min(int(rng.paretovariate(1.0)) - 1, len(hosts) - 1)]
+        urls.append(('https://%s/page/%d?ref=%d' % (host, i, rng.randrange(5)), host, 'Page %d of %s' % (i, host)))
+    weights = list(itertools.accumulate(1 / (i + 1) for i in range(len(urls))))
+
+    def generate():
+        step = FIXTURE_SPAN / visits
+        start = time.time() - FIXTURE_SPAN
+        for i in range(0, visits, FIXTURE_BATCH):
+            choices = rng.choices(range(len(urls)), cum_weights=weights, k=min(visits - i, FIXTURE_BATCH))
+            for j, url in enumerate(choices, i):
+                yield url, start + j * step + rng.random() * step, int(rng.expovariate(1 / 30e6))
+
+    return urls, generate()
+
+def insert_batches(connection, statement, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == FIXTURE_BATCH:
+            connection.executemany(statement, batch)
+            batch = []
+    connection.executemany(statement, batch)
+
+def make_safari(path, visits, seed=0):
+    # Only the columns HistoryLane reads, plus a few others so that rows are about as wide as the real thing
+    urls, history = synthetic_history(visits, seed)
+    connection = sqlite3.connect(path)
+    connection.executescript('''
+        create table history_items (id integer primary key autoincrement, url text not null unique,
+            domain_expansion text null, visit_count integer not null, daily_visit_counters blob not null,
+            weekly_visit_counters blob null, should_recompute_derived_visit_counts integer not null,
+            visit_count_score integer not null, status_code integer not null default 0);
+        create table history_visits (id integer primary key autoincrement, history_item integer not null,
+            visit_time real not null, title text null, load_successful boolean not null default 1,
+            http_non_get boolean not null default 0, synthesized boolean not null default 0,
+            redirect_source integer null unique, redirect_destination integer null unique, origin integer not null
+            default 0, generation integer not null default 0, attributes integer not null default 0,
+            score integer not null default 0);
+        create index history_visits__last_visit on history_visits (history_item, visit_time desc, synthesized asc);
+        create index history_visits__origin on history_visits (origin, generation);
+        create index history_visits__visit_time on history_visits (visit_time);
+    ''')
+    with connection:
+        connection.executemany('insert into history_items (id, url, domain_expansion, visit_count, '
+                               'daily_visit_counters, should_recompute_derived_visit_counts, visit_count_score) '
+                               'values (?, ?, ?, 0, x\'\', 0, 0)',
+                               ((i + 1, url, host.split('.')[-2] if '.' in host else None)
+                                for i, (url, host, title) in enumerate(urls)))
+        insert_batches(connection, 'insert into history_visits (history_item, visit_time, title) values (?, ?, ?)',
+                       ((url + 1, t - browserhandler.SAFARI_EPOCH, urls[url][2]) for url, t, duration in history))
+        connection.execute('update history_items set visit_count = '
+                           '(select count(*) from history_visits where history_item = history_items.id)')
+    connection.close()
+
+def make_firefox(directory, visits, seed=0):
+    urls, history = synthetic_history(visits, seed)
+    connection = sqlite3.connect(directory + '/places.sqlite')
+    connection.executescript('''
+        create table moz_places (id integer primary key, url longvarchar, title longvarchar, rev_host longvarchar,
+            visit_count integer default 0, hidden integer default 0 not null, typed integer default 0 not null,
+            frecency integer default -1 not null, last_visit_date integer, guid text, foreign_count integer default 0
+            not null, url_hash integer default 0 not null, description text, preview_image_url text,
+            site_name text, origin_id integer, recalc_frecency integer not null default 0, alt_frecency integer,
+            recalc_alt_frecency integer not null default 0);
+        create table moz_historyvisits (id integer primary key, from_visit integer, place_id integer,
+            visit_date integer, visit_type integer, session integer, source integer default 0 not null,
+            triggeringPlaceId integer);
+        create index moz_places_hostindex on moz_places (rev_host);
+        create index moz_historyvisits_placedateindex on moz_historyvisits (place_id, visit_date);
+        create index moz_historyvisits_dateindex on moz_historyvisits (visit_date);
+    ''')
+    with connection:
+        connection.executemany('insert into moz_places (id, url, title, rev_host) values (?, ?, ?, ?)',
+                               ((i + 1, url, title, host.split(':')[0][::-1] + '.')
+                                for i, (url, host, title) in enumerate(urls)))
+        insert_batches(connection, 'insert into moz_historyvisits (from_visit, place_id, visit_date, visit_type) '
+                                   'values (0, ?, ?, 1)',
+                       ((url + 1, int(t * 1e6)) for url, t, duration in history))
+        connection.execute('update moz_places set visit_count = '
+                           '(select count(*) from moz_historyvisits where place_id = moz_places.id)')
+    connection.close()
+
+def make_vivaldi(directory, visits, seed=0):
+    urls, history = synthetic_history(visits, seed)
+    webkit = -browserhandler.WEBKIT_EPOCH
+    connection = sqlite3.connect(directory + '/History')
+    connection.executescript('''
+        create table urls (id integer primary key autoincrement, url longvarchar, title longvarchar,
+            visit_count integer default 0 not null, typed_count integer default 0 not null,
+            last_visit_time integer not null default 0, hidden integer default 0 not null);
+        create table visits (id integer primary key autoincrement, url integer not null, visit_time integer not null,
+            from_visit integer, transition integer default 0 not null, segment_id integer,
+            visit_duration integer default 0 not null, incremented_omnibox_typed_score boolean default false not null,
+            opener_visit integer, originator_cache_guid text, originator_visit_id integer);
+        create table clusters_and_visits (cluster_id integer not null, visit_id integer not null,
+            score numeric default 0 not null, engagement_score numeric default 0 not null,
+            url_for_deduping longvarchar not null, normalized_url longvarchar not null,
+            url_for_display longvarchar not null, interaction_state integer default 0 not null,
+            primary key (cluster_id, visit_id)) without rowid;
+        create index urls_url_index on urls (url);
+        create index visits_url_index on visits (url);
+        create index visits_time_index on visits (visit_time);
+        create index clusters_for_visit on clusters_and_visits (visit_id);
+    ''')
+    with connection:
+        connection.executemany('insert into urls (id, url, title) values (?, ?, ?)',
+                               ((i + 1, url, title) for i, (url, host, title) in enumerate(urls)))
+
+        def visit_rows():
+            for i, (url, t, duration) in enumerate(history):
+                yield i + 1, url + 1, int((t + webkit) * 1e6), duration
+
+        insert_batches(connection, 'insert into visits (id, url, visit_time, from_visit, visit_duration) '
+                                   'values (?, ?, ?, 0, ?)', visit_rows())
+        connection.execute('update urls set visit_count = (select count(*) from visits where url = urls.id)')
+        # Chrome clusters visits by topic; one visit in a cluster per few dozen is near enough. url_for_display is
+        # the URL without its scheme or "www.", as Chrome shows it.
+        connection.execute('insert into clusters_and_visits (cluster_id, visit_id, url_for_deduping, normalized_url, '
+                           'url_for_display) '
+                           'select visits.id / 40, visits.id, substr(urls.url, 1, instr(substr(urls.url, 9), \'/\') + 8),'
+                           ' urls.url, substr(urls.url, instr(urls.url, \'://\') + '
+                           'case when urls.url like \'%://www.%\' then 7 else 3 end) '
+                           'from visits join urls on urls.id = visits.url')
+    connection.close()
+
+def fixture(browser, visits, directory=FIXTURE_DIR, regenerate=False):
+    # Returns a history object for a made-up history of the given size, generating it first if need be.
+    root = os.path.join(directory, '%s-%d' % (browser, visits))
+    done = root + '/complete'
+    if regenerate or not os.path.exists(done):
+        if os.path.isdir(root):
+            for i in os.listdir(root):
+                os.remove(os.path.join(root, i))
+        os.makedirs(root, exist_ok=True)
+        start = time.perf_counter()
+        if browser == 'safari':
+            make_safari(root + '/History.db', visits)
+        elif browser == 'firefox':
+            make_firefox(root, visits)
+        else:
+            # Vivaldi's database has every table that Chrome's query reads, and then some
+            make_vivaldi(root, visits)
+        open(done, 'w').close()
+        print('Generated %s history of %d visits in %.1f seconds' % (browser, visits, time.perf_counter() - start),
+              file=sys.stderr)
+    return lambda: open_fixture(browser, root)
+
+def open_fixture(browser, root):
+    if browser == 'safari':
+        return browserhandler.SafariHistory(root + '/History.db')
+    return browserhandler.BACKENDS[browser](root)
+
+class Measurement:
+    # Counts the SQL statements run on any connection handed to trace().
+    def __init__(self):
+        self.statements = 0
+
+    def trace(self, connection):
+        connection.set_trace_callback(self.count)
+        return connection
+
+    def count(self, statement):
+        self.statements += 1
+
+# Each benchmark is called with a function that opens the fixture afresh, a Measurement, and the fixture's history
+# already loaded into a VisitTable (for the charts), and returns the number of visits it dealt with.
+def bench_iter_visits(open_source, measurement, table):
+    source = open_source()
+    measurement.trace(source.connection)
+    return sum(len(batch) for batch in source.iter_visits())
+
+def bench_count_domains(open_source, measurement, table):
+    source = open_source()
+    measurement.trace(source.connection)
+    return sum(source.count_domains().values())
+
+def bench_top_k_count(open_source, measurement, table):
+    # Counting by domain in one pass over the visits, in fixed memory
+    source = open_source()
+    measurement.trace(source.connection)
+    summary = heavyhitters.SpaceSaving(TOP_K)
+    summary.update(row[1] for batch in source.iter_visits() for row in batch if row[1] is not None)
+    return summary.total
+
+def bench_load(open_source, measurement, table):
+    source = open_source()
+    measurement.trace(source.connection)
+    return browserhandler.collect_visits(row for batch in source.iter_visits() for row in batch).row_count()
+
+def bench_cache_update(open_source, measurement, table):
+    # From an empty cache, i.e. the first run after installing
+    source = open_source()
+    measurement.trace(source.connection)
+    path = os.path.join(os.path.dirname(source.path), 'cache.sqlite')
+    if os.path.exists(path):
+        os.remove(path)
+    cache = historycache.HistoryCache(path)
+    measurement.trace(cache.connection)
+    cache.update('benchmark', 'benchmark', source)
+    return cache.connection.execute('select count(*) from visits').fetchone()[0]
+
+def bench_cached_count(open_source, measurement, table):
+    # Counting by domain from an up-to-date cache (left by cache_update, or filled here first), as pie and bar
+    # charts do on every run after the first
+    source = open_source()
+    measurement.trace(source.connection)
+    cache = historycache.HistoryCache(os.path.join(os.path.dirname(source.path), 'cache.sqlite'))
+    measurement.trace(cache.connection)
+    return sum(cache.count_domains('benchmark', 'benchmark', source).values())
+
+def bench_cached_search(open_source, measurement, table):
+    # The 20 best matches for the most visited host's name, among every visit in an up-to-date cache
+    source = open_source()
+    measurement.trace(source.connection)
+    cache = historycache.HistoryCache(os.path.join(os.path.dirname(source.path), 'cache.sqlite'))
+    measurement.trace(cache.connection)
+    source_id = cache.update('benchmark', 'benchmark', source)
+    return len(cache.search(HOST_PATTERNS[0] % 0, [source_id]))
+
+def draw(figure):
+    # Making a figure does not draw it; this does, as saving or showing it would.
+    figure.canvas.draw()
+    chartgen.close_plot(figure)
+
+def bench_piechart(open_source, measurement, table):
+    draw(chartgen.generate_piechart(table, th=table.row_count() // 100))
+    return table.row_count()
+
+def bench_barchart(open_source, measurement, table):
+    draw(chartgen.generate_barchart(table, th=table.row_count() // 1000))
+    return table.row_count()
+
+def bench_scatterplot(open_source, measurement, table):
+    draw(chartgen.generate_scatterplot(table, 'time', 'counter'))
+    return table.row_count()
+
+def memory_per_visit(table):
+    # Returns (bytes per visit held in table, bytes per visit held the old way), the latter from the first
+    # CONTAINER_SAMPLE of the table's visits.
+    sample = {}
+    for i, row in zip(range(CONTAINER_SAMPLE), table.rows()):
+        sample.setdefault(row[1], []).append(browserhandler.VisitContainer(*row[2:7]))
+    visits = min(table.row_count(), CONTAINER_SAMPLE)
+    return table.bytes_per_visit(), visittable.container_memory_usage(sample) / visits if visits else 0
+
+def measure(benchmark, open_source, table, repeat=1, memory=True):
+    # Returns the benchmark's results: the best wall-clock and CPU time of repeat runs, the visits per second that
+    # makes, the number of SQL statements run, and (unless memory is off) the peak memory allocated.
+    best = None
+    for i in range(repeat):
+        measurement = Measurement()
+        gc.collect()
+        start, cpu = time.perf_counter(), time.process_time()
+        rows = benchmark(open_source, measurement, table)
+        seconds, cpu = time.perf_counter() - start, time.process_time() - cpu
+        if best is None or seconds < best['seconds']:
+            best = {'seconds': seconds, 'cpu_seconds': cpu, 'rows': rows,
+                    'rows_per_second': rows / seconds if seconds else None, 'queries': measurement.statements}
+
+    best['peak_memory'] = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            benchmark(open_source, Measurement(), table)
+            best['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best
+
+def environment():
+    import matplotlib
+    import numpy
+    return {'generated': datetime.datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version, 'numpy': numpy.__version__, 'matplotlib': matplotlib.__version__,
+            'platform': platform.platform(), 'processor': platform.processor() or platform.machine()}
+
+def key(result):
+    return result['browser'], result['visits'], result['benchmark']
+
+def print_header(previous=None):
+    print('%-8s %10s %-14s %9s %13s %8s %11s %s' % ('browser', 'visits', 'benchmark', 'seconds', 'visits/sec',
+                                                     'queries', 'peak MB', 'change' if previous else ''))
+
+def print_result(result, previous=None):
+    # With previous results, also show how the speed compares with the same benchmark's last time.
+    change = ''
+    for i in previous or []:
+        if key(i) == key(result) and i['seconds']:
+            change = '%+.0f%%' % ((result['seconds'] / i['seconds'] - 1) * 100)
+    print('%-8s %10d %-14s %9.3f %13.0f %8d %11s %s' % (
+        result['browser'], result['visits'], result['benchmark'], result['seconds'], result['rows_per_second'] or 0,
+        result['queries'], '-' if result['peak_memory'] is None else '%.1f' % (result['peak_memory'] / 1e6), change))
+    if 'bytes_per_visit' in result:
+        print('%-8s %10s   %.0f bytes per visit in a VisitTable, %.0f as VisitContainers' % (
+            '', '', result['bytes_per_visit'], result['container_bytes_per_visit']))
+
+def main(arguments=None):
+    cmdline = argparse.ArgumentParser(description='Time HistoryLane against made-up browser histories.')
+    cmdline.add_argument('--sizes', type=parse_size, nargs='+', default=[10_000, 100_000],
+                         help='Numbers of visits to generate histories of, e.g. 10k 1M 10M. Defaults to 10k and 100k.')
+    cmdline.add_argument('--browsers', nargs='+', choices=BROWSERS, default=BROWSERS,
+                         help='Browsers whose databases to imitate. Defaults to all of them.')
+    cmdline.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=BENCHMARKS,
+                         help='Benchmarks to run. Defaults to all of them.')
+    cmdline.add_argument('--repeat', type=int, default=1,
+                         help='Run each benchmark this many times and keep the fastest.')
+    cmdline.add_argument('--no-memory', dest='memory', action='store_false',
+                         help='Skip measuring peak memory, which takes an extra, slower run of each benchmark.')
+    cmdline.add_argument('--fixtures', default=FIXTURE_DIR,
+                         help='Where to keep the generated databases. Defaults to %s.' % FIXTURE_DIR)
+    cmdline.add_argument('--regenerate', action='store_true',
+                         help='Generate the databases again even if they already exist.')
+    cmdline.add_argument('-o', '--output', default='benchmark-results.json',
+                         help='File to write the results to, as JSON.')
+    cmdline.add_argument('--compare', help='Earlier results file to compare these results against.')
+    argv = cmdline.parse_args(arguments)
+
+    chartgen.use_headless_backend()
+    if any(i in argv.benchmarks for i in ('piechart', 'barchart', 'scatterplot')):
+        # matplotlib loads its fonts the first time anything is drawn; keep that out of the first chart's time
+        draw(chartgen.generate_piechart({'warm-up': [None]}))
+    previous = None
+    if argv.compare:
+        with open(argv.compare, encoding='utf-8') as f:
+            previous = json.load(f)['results']
+
+    results = []
+    print_header(previous)
+    for visits in argv.sizes:
+        for browser in argv.browsers:
+            open_source = fixture(browser, visits, argv.fixtures, argv.regenerate)
+            table = None
+            if any(i in argv.benchmarks for i in ('load', 'piechart', 'barchart', 'scatterplot')):
+                table = browserhandler.collect_visits(row for batch in open_source().iter_visits() for row in batch)
+            for name in argv.benchmarks:
+                result = {'browser': browser, 'visits': visits, 'benchmark': name}
+                result.update(measure(globals()['bench_' + name], open_source, table, argv.repeat, argv.memory))
+                if name == 'load' and argv.memory:
+                    # What the loaded VisitTable takes up, next to the same visits held the old way
+                    result['bytes_per_visit'], result['container_bytes_per_visit'] = memory_per_visit(table)
+                results.append(result)
+                print_result(result, previous)
+
+    with open(argv.output, 'w', encoding='utf-8') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=2)
+    print('Results written to %s' % argv.output, file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
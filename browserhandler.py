@@ -4,13 +4,36 @@ import time
 import json
 import glob
 import sys
+import collections
+import functools
+import heapq
+import itertools
+import pathlib
+import queue
+import threading
+import domains
+import profiling
+import visittable
 
 USER_DIR = os.path.expanduser('~')  # Cross-platform courtesy of Python
 
 # Apple Safari constants
 SAFARI_HISTORY_DB = USER_DIR + '/Library/Safari/History.db'
 SAFARI_EPOCH = 978307200  # midnight UTC on 1 January 2001, as per the usual epoch of midnight GMT on 1/1/70
-SAFARI_EPOCH_WEBKIT = 116_444_73600 + 978307200  # Seconds between 1/1/1601 and 1/1/2001 - bridge Safari and Chrome
+WEBKIT_EPOCH = -11_644_473_600  # midnight UTC on 1 January 1601, whence Chrome-based browsers count, as a Unix time
+
+# Number of visits fetched from a database at a time when streaming (see HistorySource.iter_visits)
+BATCH_SIZE = 10_000
+
+# Visits to the same URL recorded by two different sources less than this many seconds apart are taken to be one
+# visit recorded twice (e.g., through browser sync, or a history imported from another browser); see merge_timelines
+DUPLICATE_WINDOW = 1.0
+
+# Seconds to wait for the browser to finish writing before reading from a snapshot instead (see open_database)
+LOCK_TIMEOUT = 0.25
+
+# Domains with fewer visits than a chart's threshold are counted together under this name (see count_domains)
+EVERYTHING_ELSE = 'Everything Else'
 
 # Mozilla Firefox constants
 if sys.platform == 'darwin':
@@ -21,7 +44,7 @@ elif sys.platform == 'win32':
     FIREFOX_DIR = USER_DIR + '/AppData/Roaming/Mozilla/Firefox'
 else:
     # UNIX arts-and-crafts
-    FIREFOX_DIR = USER_DIR + '.mozilla/firefox'
+    FIREFOX_DIR = USER_DIR + '/.mozilla/firefox'
 
 # Vivaldi constants
 if sys.platform == 'darwin':
@@ -29,7 +52,21 @@ if sys.platform == 'darwin':
 elif sys.platform == 'win32':
     VIVALDI_DIR = USER_DIR + '/AppData/Local/Vivaldi'
 else:
-    VIVALDI_DIR = USER_DIR + '.config/vivaldi'
+    VIVALDI_DIR = USER_DIR + '/.config/vivaldi'
+
+# Google Chrome, Microsoft Edge and Brave constants
+if sys.platform == 'darwin':
+    CHROME_DIR = USER_DIR + '/Library/Application Support/Google/Chrome'
+    EDGE_DIR = USER_DIR + '/Library/Application Support/Microsoft Edge'
+    BRAVE_DIR = USER_DIR + '/Library/Application Support/BraveSoftware/Brave-Browser'
+elif sys.platform == 'win32':
+    CHROME_DIR = USER_DIR + '/AppData/Local/Google/Chrome/User Data'
+    EDGE_DIR = USER_DIR + '/AppData/Local/Microsoft/Edge/User Data'
+    BRAVE_DIR = USER_DIR + '/AppData/Local/BraveSoftware/Brave-Browser/User Data'
+else:
+    CHROME_DIR = USER_DIR + '/.config/google-chrome'
+    EDGE_DIR = USER_DIR + '/.config/microsoft-edge'
+    BRAVE_DIR = USER_DIR + '/.config/BraveSoftware/Brave-Browser'
 
 
 class VisitContainer:
@@ -45,15 +82,441 @@ class VisitContainer:
         self.counter = counter
         # Only Chrome-based browsers give this to me, and calculating it based on time is error prone.
         # Thus only used with those.
+        # 10/17/26: charts now estimate it from the visits' times where it is 0 (see aggregate.sessionize).
         self.duration = duration
 
-class SafariHistory:
-    # Allow browser-wide attributes.
-    def __init__(self):
+# 10/17/26: every scraper's iter_visits() and rows() methods return visits in one normalized shape, so that they can
+# be cached (see historycache.py), stored (see visittable.py) and counted (see chartgen.py) in one place:
+#    (visit_id, domain, url, title, time, counter, duration)
+# visit_id is the browser's own, monotonically increasing ID for the visit; time is in Safari time.
+
+def collect_visits(rows):
+    # Turn normalized rows into a VisitTable, which behaves like the usual {domain: [VisitContainer, ...]} mapping.
+    with profiling.stage('normalize'):
+        table = visittable.VisitTable(rows)
+        profiling.count(table.row_count())
+        return table
+
+def merge_visits(tables):
+    # Combine several VisitTables (e.g., one per profile) into one, numbering each one's visits as a source of its own.
+    with profiling.stage('normalize'):
+        merged = visittable.VisitTable()
+        for source, i in enumerate(tables):
+            merged.extend(i.rows(), source)
+        profiling.count(merged.row_count())
+        return merged
+
+def fetch_batches(cursor, batch_size=BATCH_SIZE):
+    # Yield the results of a query batch_size rows at a time, rather than all at once as fetchall() would.
+    # The stage is left before each batch is handed over, so whatever is done with the batch is not counted in it.
+    while True:
+        with profiling.stage('extract'):
+            batch = cursor.fetchmany(batch_size)
+            profiling.count(len(batch))
+        if not batch:
+            return
+        yield batch
+
+# 10/17/26: time windows and thresholds are applied by SQLite, not here, so that only the rows a chart needs are ever
+# read. The two functions below take a query that selects normalized rows (with the columns named as above) and
+# either stream them or count them by domain.
+
+def select_visits(connection, query, parameters, threshold=0, batch_size=BATCH_SIZE, order='visit_id'):
+    # Stream the rows selected by query in batches, sorted by the column order. With a threshold, only visits to
+    # domains that have at least that many visits among those selected are kept, and order must then be one of the
+    # normalized columns.
+    if threshold > 1:
+        query = ('with selected as (%s) select * from selected where domain in '
+                 '(select domain from selected group by domain having count(*) >= ?)' % query)
+        parameters = parameters + [threshold]
+
+    with profiling.stage('extract'):
+        cursor = connection.execute(query + ' order by ' + order, parameters)
+    yield from fetch_batches(cursor, batch_size)
+
+def count_domains(connection, query, parameters, threshold=0):
+    # Returns a Counter of visits per domain among the rows selected by query. Domains with fewer visits than the
+    # threshold are added up into one entry, EVERYTHING_ELSE, so that only the domains worth charting come back.
+    # Visits without a domain are left out altogether, as the charts have always done.
+    counts = collections.Counter()
+    with profiling.stage('extract'):
+        for domain, visits in connection.execute(
+                'select case when visits >= ? then domain end, sum(visits) from '
+                '(select domain, count(*) as visits from (%s) where domain is not null group by domain) '
+                'group by 1' % query, [threshold] + parameters):
+            counts[EVERYTHING_ELSE if domain is None else domain] = visits
+        profiling.count(sum(counts.values()))
+    return counts
+
+def sum_domains(connection, query, parameters, threshold=0):
+    # As count_domains(), but query selects (domain, visits) pairs, such as the rows of a rollup table, whose visits
+    # are added up rather than counted.
+    counts = collections.Counter()
+    with profiling.stage('extract'):
+        for domain, visits in connection.execute(
+                'select case when visits >= ? then domain end, sum(visits) from '
+                '(select domain, sum(visits) as visits from (select domain, visits from (%s)) '
+                'where domain is not null group by domain) '
+                'group by 1' % query, [threshold] + parameters):
+            counts[EVERYTHING_ELSE if domain is None else domain] = visits
+        profiling.count(sum(counts.values()))
+    return counts
+
+def reverse_host(rev_host):
+    # Firefox stores hosts backwards, e.g. "moc.elpmaxe." for example.com
+    if rev_host is None:
+        return None
+    return ''.join(reversed(rev_host))
+
+def no_history(error):
+    # Whether an sqlite3.OperationalError only means that there is no history to read
+    return str(error).startswith('no such table') or str(error).startswith('unable to open database file')
+
+def database_uri(path, parameters):
+    return pathlib.Path(os.path.abspath(path)).as_uri() + '?' + parameters
+
+def locked(error):
+    # Whether an sqlite3.OperationalError means that the browser is keeping the database to itself
+    return str(error).startswith('database is locked')
+
+def open_database(path):
+    # Open a browser's database for reading. Returns (connection, whether it is a snapshot).
+    # 10/17/26: the database is opened read-only, so that the browser's own database can never be written to, nor an
+    # empty one created where there is none, and its locks and write-ahead log are respected. The browser may still
+    # have it locked, though: Chrome-based browsers keep their history locked for as long as they run, and any
+    # browser locks it while writing. Rather than wait, or give up, HistoryLane then reads from a snapshot (see
+    # snapshot_database). Connections are kept for the whole run (see HistorySource.connection).
+    connection = sqlite3.connect(database_uri(path, 'mode=ro'), uri=True, timeout=LOCK_TIMEOUT,
+                                 check_same_thread=False)
+    try:
+        # Nothing is read from the file until the first query
+        connection.execute('select count(*) from sqlite_master').fetchone()
+        return connection, False
+    except sqlite3.OperationalError as e:
+        connection.close()
+        if not locked(e):
+            raise
+    return snapshot_database(path), True
+
+def snapshot_database(path):
+    # A copy of a database the browser has locked, made page by page with SQLite's backup API into a temporary
+    # database, which SQLite keeps in memory while it is small and deletes once closed. The browser's lock is ignored
+    # (immutable=1), since sqlite3's backup() would otherwise wait for as long as the lock is held. The copy misses
+    # whatever is still in the write-ahead log, and any visits recorded while it is made.
+    with profiling.stage('extract'):
+        snapshot = sqlite3.connect('', check_same_thread=False)
+        source = sqlite3.connect(database_uri(path, 'immutable=1'), uri=True)
+        try:
+            source.backup(snapshot)
+        except sqlite3.Error:
+            snapshot.close()
+            raise
+        finally:
+            source.close()
+        return snapshot
+
+# 10/17/26: every browser HistoryLane can read, by the name given to -w, in the order they were registered
+BACKENDS = {}
+
+def register(backend):
+    # Add a HistorySource subclass to BACKENDS; used as a class decorator.
+    BACKENDS[backend.NAME] = backend
+    return backend
+
+class HistorySource:
+    # 10/17/26: what every browser's history object has in common. Opening the database and reading its visits are
+    # both put off until they are actually needed, so that profiles can be listed without reading any of them.
+    # Each browser (see register) describes itself with:
+    #    NAME and LABEL: its name for -w, and the name it goes by
+    #    VISITS: a select statement returning normalized rows, with the columns named as above, except that time is
+    #       written as {time}, which is filled in from VISIT_TIME (see time_column)
+    #    VISIT_ID and VISIT_TIME: the columns holding the browser's ID for each visit and its time, in the browser's
+    #       own units, so that conditions on them can use the browser's indices
+    #    EPOCH and TICKS_PER_SECOND: those units, as the Unix time the browser counts from and the number of times a
+    #       second it counts
+    # and default_directory(), where it keeps its history. A browser whose profiles are not simply the directories
+    # found there also has a profile_directories() of its own. Reading, batching, converting times and keeping
+    # statistics are then all done here, the same way for every browser.
+    NAME = None
+    LABEL = None
+    EPOCH = 0
+    TICKS_PER_SECOND = 1
+
+    # Whether the browser has profiles, one of which must be chosen with -u (or --all-profiles), and the message for
+    # when none is
+    HAS_PROFILES = True
+    PROFILE_REQUIRED = 'A profile must be provided with -u'
+
+    # The sys.platform values the browser runs on, if not all of them
+    PLATFORMS = None
+
+    def __init__(self, path):
+        self.path = path
         self.maximum_counter = -1
-        self.entries = {}
+        self.maximum_duration = -1
+        self.snapshot = False
+        self.__connection = None
+        self.__entries = None
+
+    @property
+    def connection(self):
+        # Opened the first time it is needed, and then used for everything read from this profile (see open_database).
+        if self.__connection is None:
+            # check_same_thread is off so that profiles can be read from a pool of threads (see load_profiles).
+            # Each connection is only ever used by one thread at a time.
+            connection, self.snapshot = open_database(self.path)
+            self.__connection = profiling.trace(connection)
+            # Domains are worked out by SQLite itself, through these, the same way for every browser (see domains.py).
+            self.__connection.create_function('hl_url_domain', 1, domains.url_domain, deterministic=True)
+            self.__connection.create_function('hl_host_domain', 1, domains.host_domain, deterministic=True)
+            self.__connection.create_function('hl_reverse_host', 1, reverse_host, deterministic=True)
+        return self.__connection
+
+    def discard_snapshot(self):
+        # A snapshot never changes. Drop it, if the connection is one, so that the next read starts afresh from the
+        # browser's database; needed only by programs that keep running while the browser records more visits.
+        if self.snapshot:
+            self.__connection.close()
+            self.__connection = None
+            self.snapshot = False
+
+    @property
+    def entries(self):
+        if self.__entries is None:
+            self.get_visits()
+        return self.__entries
+
+    def store_visits(self, rows):
+        self.__entries = collect_visits(rows)
+        self.maximum_counter = self.__entries.maximum_counter
+        self.maximum_duration = self.__entries.maximum_duration
+        return self.__entries
+
+    @classmethod
+    def time_column(cls):
+        # VISIT_TIME in Safari time, as SQL; SQLite converts every row's time as it reads it.
+        column = cls.VISIT_TIME
+        if cls.TICKS_PER_SECOND != 1:
+            column = '%s / %.1f' % (column, cls.TICKS_PER_SECOND)
+        if cls.EPOCH != SAFARI_EPOCH:
+            column = '%s - %d' % (column, SAFARI_EPOCH - cls.EPOCH)
+        return column
+
+    @classmethod
+    def native_time(cls, t):
+        # A Unix time in the browser's own units
+        native = (t - cls.EPOCH) * cls.TICKS_PER_SECOND
+        return int(native) if cls.TICKS_PER_SECOND != 1 else native
+
+    @classmethod
+    def default_directory(cls):
+        # Where the browser keeps its history on this computer: the directory holding its profiles or, if it has none,
+        # the path of its one history. None if it is kept nowhere known, in which case no profiles are found.
+        return None
+
+    @classmethod
+    def profile_directories(cls, directory=None):
+        # Returns {profile name: profile directory} for every profile in directory (by default, default_directory()):
+        # each of the directories in it, by name. A browser without profiles has only the one history, directory
+        # itself, whose profile name is None.
+        directory = directory or cls.default_directory()
+        if directory is None:
+            return {}
+        if not cls.HAS_PROFILES:
+            return {None: directory}
+        return {os.path.basename(i): i for i in glob.glob(directory + '/*') if os.path.isdir(i)}
 
-def get_all_safari_data():
+    @classmethod
+    def all_profiles(cls, directory=None):
+        # Every profile, as {name: profile}. Profiles are not read until their entries are used.
+        return {name: cls(path) for name, path in cls.profile_directories(directory).items()}
+
+    def high_water(self):
+        # The browser's largest visit ID, or 0 if it has no history
+        try:
+            return self.connection.execute('select max(%s) from %s' % (self.VISIT_ID, self.VISIT_ID.split('.')[0])
+                                           ).fetchone()[0] or 0
+        except sqlite3.OperationalError as e:
+            if not no_history(e):
+                raise
+            return 0
+
+    def visit_query(self, since_id=0, since=None, until=None):
+        # The query for every visit newer than since_id and, if given, between the Unix times since and until.
+        # Conditions are only added when they are needed; SQLite would otherwise prefer a range over every visit ID
+        # to the browser's index on visit times.
+        conditions = []
+        parameters = []
+        if since_id > 0:
+            conditions.append('%s > ?' % self.VISIT_ID)
+            parameters.append(since_id)
+        if since is not None:
+            conditions.append('%s >= ?' % self.VISIT_TIME)
+            parameters.append(self.native_time(since))
+        if until is not None:
+            conditions.append('%s < ?' % self.VISIT_TIME)
+            parameters.append(self.native_time(until))
+
+        query = self.VISITS.format(time=self.time_column())
+        if len(conditions) == 0:
+            return query, parameters
+        return query + ' where ' + ' and '.join(conditions), parameters
+
+    def iter_visits(self, batch_size=BATCH_SIZE, since_id=0, since=None, until=None, threshold=0, by_time=False):
+        # Visits come in the order the browser recorded them (by visit ID) or, with by_time, in order of time.
+        query, parameters = self.visit_query(since_id, since, until)
+        order = 'visit_id'
+        if by_time:
+            # By the browser's own column where possible, so that SQLite can use its index rather than sort
+            order = 'time' if threshold > 1 else self.VISIT_TIME
+        try:
+            yield from select_visits(self.connection, query, parameters, threshold, batch_size, order)
+        except sqlite3.OperationalError as e:
+            # no such table (or no database at all), which indicates that no history exists
+            if not no_history(e):
+                raise
+
+    def count_domains(self, since=None, until=None, threshold=0):
+        query, parameters = self.visit_query(0, since, until)
+        try:
+            return count_domains(self.connection, query, parameters, threshold)
+        except sqlite3.OperationalError as e:
+            if not no_history(e):
+                raise
+            return collections.Counter()
+
+    def rows(self, since_id=0, since=None, until=None, threshold=0):
+        # The same visits as iter_visits(), as one list of normalized rows.
+        return [row for batch in self.iter_visits(since_id=since_id, since=since, until=until, threshold=threshold)
+                for row in batch]
+
+    def get_visits(self):
+        return self.store_visits(row for batch in self.iter_visits() for row in batch)
+
+def map_profiles(profiles, load, workers=None):
+    # Call load(name, profile) for every profile in a {name: profile} mapping at once, and return the results in a
+    # list. SQLite lets go of the GIL while it runs a query, so the reads overlap in a thread pool, and wall time
+    # tracks the largest profile rather than all of them added together.
+    import concurrent.futures  # only needed here, and slow to import
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda item: load(*item), profiles.items()))
+
+def load_profiles(profiles, load=None, workers=None):
+    # Read several profiles at once and merge them into a single VisitTable.
+    # load(name, profile) returns a profile's VisitTable, and defaults to reading profile.entries.
+    if load is None:
+        load = lambda name, profile: profile.entries
+
+    return merge_visits(map_profiles(profiles, load, workers))
+
+# 10/17/26: reading several browsers into one timeline. Each source is read on a thread of its own, which stays a
+# few batches ahead of the merge, so that the sources' queries run side by side and only a few batches from each are
+# ever held at once. The merge takes visits from whichever source has the earliest next one (a k-way merge, via
+# heapq.merge), which needs every source's visits to be in order of time already (see iter_visits' by_time).
+
+def prefetch(open_stream, depth=2):
+    # Call open_stream() and read the stream of batches it returns on a thread of its own, keeping up to depth
+    # batches ready. Returns a stream of the same batches. If the stream is abandoned, the thread gives up too.
+    ready = queue.Queue(depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                ready.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for batch in open_stream():
+                if not put(('batch', batch)):
+                    return
+            put(('done', None))
+        except BaseException as e:
+            put(('error', e))
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    def consume():
+        try:
+            while True:
+                kind, item = ready.get()
+                if kind == 'done':
+                    return
+                if kind == 'error':
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+    return consume()
+
+def tag_rows(browser, profile, batches):
+    for batch in batches:
+        for row in batch:
+            yield browser, profile, row
+
+def merge_timelines(streams, window=DUPLICATE_WINDOW, batch_size=BATCH_SIZE):
+    # Merge several sources' visits into one timeline. streams is a list of (browser, profile, batches), each batches
+    # being a stream of batches of normalized rows in order of time. Yields batches of (browser, profile, row), in
+    # order of time, from which the same visit recorded by more than one source (see DUPLICATE_WINDOW), or recorded
+    # twice by the same source, has been left out.
+    merged = heapq.merge(*(tag_rows(*i) for i in streams), key=lambda item: item[2][4])
+    recent = collections.deque()  # (time, url) of each visit kept in the last window seconds
+    seen = {}  # url -> [(browser, profile, visit_id), ...] for those same visits, oldest first
+    batch = []
+    for item in merged:
+        browser, profile, row = item
+        visit_id, url, visit_time = row[0], row[2], row[4]
+        while recent and recent[0][0] < visit_time - window:
+            old_url = recent.popleft()[1]
+            seen[old_url].pop(0)
+            if not seen[old_url]:
+                del seen[old_url]
+
+        earlier = seen.get(url)
+        if earlier is not None and any(i[:2] != (browser, profile) or i[2] == visit_id for i in earlier):
+            continue
+        recent.append((visit_time, url))
+        seen.setdefault(url, []).append((browser, profile, visit_id))
+
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def timeline_rows(timeline):
+    # The normalized rows of a merged timeline, without their browser and profile
+    for batch in timeline:
+        for browser, profile, row in batch:
+            yield row
+
+def collect_timeline(timeline):
+    # A merged timeline as one VisitTable, with each (browser, profile) numbered as a source in order of its first
+    # visit.
+    with profiling.stage('normalize'):
+        table = visittable.VisitTable()
+        sources = {}
+        for batch in timeline:
+            for browser, profile, row in batch:
+                table.append(*row, source=sources.setdefault((browser, profile), len(sources)))
+        profiling.count(table.row_count())
+        return table
+
+def split_timeline(timeline):
+    # A merged timeline as (browser, profile, batches) for each run of consecutive visits from the same source, which
+    # is what historyexport.export_visits() takes.
+    for batch in timeline:
+        for (browser, profile), items in itertools.groupby(batch, key=lambda item: item[:2]):
+            yield browser, profile, [[row for browser, profile, row in items]]
+
+@register
+class SafariHistory(HistorySource):
     # This was written before Safari had profiles, and they are thus not supported.
     
     # SQLITE3 Database Structures:
@@ -84,66 +547,82 @@ def get_all_safari_data():
     #    index 11: attributes, an INTEGER
     #    index 12: score, an INTEGER
 
-    cur = sqlite3.connect(SAFARI_HISTORY_DB).cursor()
-    timestamp = (time.time() - 86400*14) - SAFARI_EPOCH
+    VISITS = ('select history_visits.id as visit_id, '
+              'hl_url_domain(history_items.url) as domain, '
+              'history_items.url as url, history_visits.title as title, {time} as time, '
+              'history_items.visit_count as counter, 0 as duration '
+              'from history_visits join history_items on history_items.id = history_visits.history_item')
+    VISIT_ID = 'history_visits.id'
+    VISIT_TIME = 'history_visits.visit_time'
+    EPOCH = SAFARI_EPOCH
 
-    # Enable fetching for the current day only
+    NAME = 'safari'
+    LABEL = 'Apple Safari'
+    HAS_PROFILES = False
+    PLATFORMS = ['darwin']
 
-    visits = cur.execute('select * from history_visits where visit_time > ?', [timestamp]).fetchall() #where visit_time > ?', [timestamp]).fetchall()
-    domains = cur.execute('select distinct domain_expansion from history_items').fetchall()
+    @staticmethod
+    def default_directory():
+        return SAFARI_HISTORY_DB
 
-    results = SafariHistory()
-    for i in domains:
-        if i is not None:
-            results.entries[i[0]] = []  # blunt instrument to prevent key None from creeping in.
-    
-    for i in range(len(visits) - 1):
-        history_item = cur.execute('select * from history_items where id = ?', [visits[i][1]]).fetchall()[0]
-        # https://www.
-        # 01234567890123
-        if history_item[2] is None:
-            domain = history_item[1]
-            if domain[4] == 's':  # secure connection
-                domain = domain[8:]
-            else:
-                domain = domain[7:]
-
-            domain = domain.split('/')[0]
-            domain = os.path.splitext(domain)[0]
-            domain = domain.replace('www.', '')
-
-            data = VisitContainer(
-                history_item[1],
-                visits[i][3],
-                visits[i][2] - timestamp,
-                history_item[3]
-            )
-
-            if data.counter > results.maximum_counter: 
-                results.maximum_counter = data.counter
-
-            if domain not in results.entries:
-                results.entries[domain] = [data]
-            else:
-                results.entries[domain].append(data)
-
-        else:
-            data = VisitContainer 
-            (
-                history_item[1],
-                visits[i][3],
-                visits[i][2] - timestamp,
-                history_item[3]
-            )
-
-            if data.counter > results.maximum_counter: 
-                results.maximum_counter = data.counter
-
-            results.entries[history_item[2]].append(data)
-             
-    return results.entries
-
-class VivaldiProfile:
+    # Allow browser-wide attributes.
+    def __init__(self, path=None):
+        HistorySource.__init__(self, path or SAFARI_HISTORY_DB)
+        # Enable fetching for the last fortnight only, unless told otherwise (a Unix time)
+        self.since = time.time() - 86400*14
+
+    def get_visits(self):
+        return self.store_visits(row for batch in self.iter_visits(since=self.since) for row in batch)
+
+def get_all_safari_data():
+    return SafariHistory().entries
+
+@functools.lru_cache(maxsize=None)
+def find_chromium_profiles(directory):
+    # Returns {profile name: profile directory} for a Chrome-based browser's directory.
+    # 10/17/26: the names of every profile are listed in the (comparatively small) "Local State" file, under
+    # profile.info_cache, keyed by the profile's directory. Read that, once per run, instead of parsing each of
+    # the vast Preferences files; fall back on those only if Local State is missing or unreadable.
+    profiles = {}
+    try:
+        with open(directory + '/Local State') as f:
+            info_cache = json.load(f)['profile']['info_cache']
+        for profile_dir, info in info_cache.items():
+            if os.path.isdir(directory + '/' + profile_dir):
+                profiles[info['name']] = directory + '/' + profile_dir
+    except (OSError, ValueError, KeyError, TypeError):
+        # The first profile's directory is called Default, and the others Profile 1, Profile 2, etc.
+        for i in glob.glob(directory + '/Default') + glob.glob(directory + '/Profile*'):
+            with open(i + '/Preferences') as f:
+                profiles[json.load(f)['profile']['name']] = i
+
+    return profiles
+
+class ChromiumProfile(HistorySource):
+    # 10/17/26: Google Chrome and the browsers built on it keep each profile's history in the same kind of database,
+    # and only differ in where they keep their profiles. Times are in microseconds since midnight UTC on 1 January
+    # 1601, and visits.url is the id of the row in urls (see VivaldiProfile for the tables).
+    VISITS = ('select visits.id as visit_id, hl_url_domain(urls.url) as domain, urls.url as url, '
+              'urls.title as title, {time} as time, urls.visit_count as counter, '
+              'visits.visit_duration as duration '
+              'from visits join urls on urls.id = visits.url')
+    VISIT_ID = 'visits.id'
+    VISIT_TIME = 'visits.visit_time'
+    EPOCH = WEBKIT_EPOCH
+    TICKS_PER_SECOND = 1_000_000
+
+    PROFILE_REQUIRED = 'A user profile must be provided with -u when analyzing Google Chrome-based browsers'
+
+    @classmethod
+    def profile_directories(cls, directory=None):
+        return find_chromium_profiles(directory or cls.default_directory())
+
+    def __init__(self, path):
+        # 10/17/26: reading the visits is an expensive operation, and is now put off until entries is first used.
+        HistorySource.__init__(self, path + '/History')
+
+@register
+class VivaldiProfile(ChromiumProfile):
     # Various bits of data are stored in ~/Library/Application Support/Vivaldi/
     # Separate directories are used for each profile
     # The salient pieces are as follows
@@ -161,7 +640,8 @@ class VivaldiProfile:
     # 2:      score, a NUMERIC (something, perhaps, to do with Vivaldi's history UI?)
     # 3:      engagement_score, a NUMERIC (will precipitate the rise of Skynet)
     # 4:      url_for_deduping, a LONGVARCHAR - this is the domain, with protocol, for a particular history entry
-    # 5:      url_for_display, a LONGVARCHAR - this contains the website's full URL.
+    # 5:      url_for_display, a LONGVARCHAR - the URL as Vivaldi shows it, without its scheme or "www.", which is
+    #         not the URL itself (that is urls.url)
     
     #   The visits table is structured as follows:
     # 0:      id, an INTEGER (I suspect that it is relatively self-explanatory)
@@ -180,87 +660,52 @@ class VivaldiProfile:
     # 5:      last_visit_time, an INTEGER, the time of the most recent visit (expressed in Chrome/WebKit time)
     # 6:      hidden, an INTEGER, which serves a purpose that I have not discerned.
 
-    @staticmethod
-    def get_all_profile_names():
-        disk_profiles = glob.glob(VIVALDI_DIR + '/Profile*')
-        profile_names = [None] * len(disk_profiles)
-        for i in range(len(disk_profiles)):
-            with open(disk_profiles[i] + '/Preferences') as f:
-                name = json.load(f)['profile']['name']
-                f.close()
-            profile_names[i] = name
-
-        return profile_names
-    
-    @staticmethod
-    def __chrome_to_safari_time(t):
-        result = t // 1_000_000  # microseconds to seconds
-        result -= SAFARI_EPOCH_WEBKIT  # Webkit to Safari/Unix
-        return result
-    
-    def __init__(self, path):
-        self.maximum_counter = -1
-        self.maximum_duration = -1
-        self.cursor = sqlite3.connect(path + '/History').cursor()
-        self.entries = None
-        self.get_visits() # 3/13/24: this is an expensive operation, but necessary to do anything with this object. Include it here.
-        
-    def get_visits(self):
-        visits = self.cursor.execute('select * from clusters_and_visits').fetchall()
-        results = {}
-        for counter, i in enumerate(visits):
-            if i[4] not in results:
-                # The domain has not yet been processed. An empty array with the proper key name must be added
-                # so that calls to results[<something or other>].append() work as intended
-                results[i[4]] = []
-            
-            # Because the relevant data are stored across three different tables, cross-referencing is necessary
-            # This must, unfortunately, be done for each and every object - a real nuisance for performance.
-            visit = self.cursor.execute('select * from visits where id = ?', [i[1]]).fetchall()[0]
-            try:
-                url_object = self.cursor.execute('select * from urls where url = ?', [i[5]]).fetchall()[0]
-            except IndexError:
-                # There is no such URL present in the database. We thus cannot fetch required data, and the visit
-                # may as well not exist. Pass it by accordingly.
-                continue
-
-            time = VivaldiProfile.__chrome_to_safari_time(visit[2])
+    # 10/17/26: the relevant data used to be cross-referenced across all three tables, with two extra queries for
+    # each and every visit. Only visits and urls are needed: Vivaldi keeps its history as every other Chrome-based
+    # browser does, and is read the same way (see ChromiumProfile). clusters_and_visits is no use for reading
+    # history as it grows, since Vivaldi only adds a visit to it some time after the visit, and not in order of
+    # visit ID: a visit clustered after a later one would fall below the cache's high-water mark and be lost.
+    NAME = 'vivaldi'
+    LABEL = 'Vivaldi'
 
-            data = VisitContainer
-            (
-                i[5],
-                url_object[2],
-                time,
-                url_object[3],
-                visit[4] # Duration, because I have that here firsthand.
-            )
+    @staticmethod
+    def default_directory():
+        return VIVALDI_DIR
 
-            if data.counter > self.maximum_counter:
-                self.maximum_counter = data.counter
+def get_all_vivaldi_data():
+    # Timestamps, as mentioned use the Chrome/Webkit format. This means that they represent microseconds
+    # elapsed since midnight UTC on January 1, 1601.
+    return VivaldiProfile.all_profiles()
 
-            if data.duration > self.maximum_duration:
-                self.maximum_duration = data.duration
+@register
+class ChromeProfile(ChromiumProfile):
+    NAME = 'chrome'
+    LABEL = 'Google Chrome'
 
-            results[i[4]].append(data)
+    @staticmethod
+    def default_directory():
+        return CHROME_DIR
 
-        self.entries = results
-        return results
+@register
+class EdgeProfile(ChromiumProfile):
+    NAME = 'edge'
+    LABEL = 'Microsoft Edge'
 
-def get_all_vivaldi_data():    
-    # Timestamps, as mentioned use the Chrome/Webkit format. This means that they represent microseconds
-    # elapsed since midnight UTC on January 1, 1601.
-    profiles = {}
+    @staticmethod
+    def default_directory():
+        return EDGE_DIR
 
-    for i in VivaldiProfile.get_all_profile_names():
-        profiles[i] = None
-        
-    for counter, i in enumerate(profiles.keys()):
-        p = VivaldiProfile(VIVALDI_DIR + '/Profile %d' % (counter + 1))
-        profiles[i] = p
+@register
+class BraveProfile(ChromiumProfile):
+    NAME = 'brave'
+    LABEL = 'Brave'
 
-    return profiles
+    @staticmethod
+    def default_directory():
+        return BRAVE_DIR
 
-class FirefoxProfile:
+@register
+class FirefoxProfile(HistorySource):
     # Partial documentation on the Firefox history database format:
     # Times (called "dates") are expressed in microseconds since midnight UTC on 1 January 1970
 
@@ -295,53 +740,59 @@ class FirefoxProfile:
     #       index 17: alt_frecency - purpose obscure
     #       index 18: recalc_alt_frecency - purpose obscure.
 
+    # 10/17/26: fetch each visit together with its moz_places row in one join rather than one lookup per visit.
+    # Mozilla time is converted to Safari time as the rows are read.
+    VISITS = ('select moz_historyvisits.id as visit_id, hl_host_domain(hl_reverse_host(moz_places.rev_host)) as domain, '
+              'moz_places.url as url, moz_places.title as title, '
+              '{time} as time, moz_places.visit_count as counter, '
+              '0 as duration '
+              'from moz_historyvisits join moz_places on moz_places.id = moz_historyvisits.place_id')
+    VISIT_ID = 'moz_historyvisits.id'
+    VISIT_TIME = 'moz_historyvisits.visit_date'
+    TICKS_PER_SECOND = 1_000_000
+
+    NAME = 'firefox'
+    LABEL = 'Mozilla Firefox'
+    PROFILE_REQUIRED = ('A profile is required when working with Mozilla Firefox. A list of profiles is available '
+                        'from Firefox\'s about:profiles page')
+
+    # Firefox and Firefox Developer Edition keep their profiles side by side; the latter's are named
+    # *.dev-edition-default
+    DEVELOPER_EDITION = False
+
     @staticmethod
-    def __mozilla_to_safari_time(t):
-        return (t / 1_000_000) - SAFARI_EPOCH
-    
+    def default_directory():
+        return FIREFOX_DIR
+
+    @classmethod
+    def profile_directories(cls, directory=None):
+        # Profiles are kept in directories named <random letters>.<profile name>, under Profiles on macOS and
+        # Windows, and in the Firefox directory itself elsewhere.
+        directory = directory or cls.default_directory()
+        profiles = {}
+        for i in glob.glob(directory + '/Profiles/*') + glob.glob(directory + '/*.*'):
+            name = os.path.basename(i)
+            if os.path.isdir(i) and name.endswith('dev-edition-default') == cls.DEVELOPER_EDITION:
+                profiles[name] = i
+        return profiles
+
     def __init__(self, path):
-        self.cursor = sqlite3.connect(path + '/places.sqlite').cursor()
-        self.entries = {}
-        self.get_visits()  # 3/13/24: you'll have to do this anyway, so do it here.
-        
-    def get_visits(self):
-        try:
-            visits = self.cursor.execute('select * from moz_historyvisits').fetchall()
-        except sqlite3.OperationalError:
-            # no such table, which indicates that no history exists
-            return {}
-        
-        try:
-            for counter, i in enumerate(visits):
-                metadata = self.cursor.execute('select * from moz_places where id = ?', [i[2]]).fetchall()[0]
-                domain = ''.join(reversed(metadata[3]))
-                if domain not in self.entries:
-                    self.entries[domain] = []
-
-                time = self.__mozilla_to_safari_time(i[3]);
-
-                data = VisitContainer
-                (
-                    None,
-                    metadata[2],
-                    time,
-                    i[4]
-                )
-                if data.counter > self.maximum_counter:
-                    self.maximum_counter = data.counter
-
-                self.entries[domain].append(data)
-        except IndexError:
-            pass
-
-        return self.entries
+        HistorySource.__init__(self, path + '/places.sqlite')
+
+@register
+class FirefoxDeveloperProfile(FirefoxProfile):
+    NAME = 'firefox-developer'
+    LABEL = 'Firefox Developer Edition'
+    DEVELOPER_EDITION = True
 
 def get_all_firefox_data():
-    profiles = {}
-    disk_profiles = glob.glob(FIREFOX_DIR + '/Profiles/*default')
-    for counter, i in enumerate(disk_profiles):
-        p = FirefoxProfile(i)
-        p.entries = p.get_visits()
-        profiles[i.split('/')[-1]] = p
+    return FirefoxProfile.all_profiles()
 
-    return profiles
+def get_all_sources():
+    # Every browser profile on this computer that has a history database, as {(browser, profile name): profile}.
+    sources = {}
+    for browser, backend in BACKENDS.items():
+        for name, profile in backend.all_profiles().items():
+            sources[(browser, name)] = profile
+
+    return {key: source for key, source in sources.items() if os.path.isfile(source.path)}
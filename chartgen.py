@@ -1,93 +1,123 @@
-import matplotlib.pyplot as plt
+# 10/17/26: matplotlib (and NumPy, which aggregate.py needs) take far longer to import than anything else HistoryLane
+# does before drawing a chart, so they are only imported by the functions below, i.e. once a chart is actually wanted.
 # import matplotlib.patches
+import profiling
+
+# Ways of drawing the scatterplot (see generate_scatterplot)
+SCATTER_MODES = ['auto', 'points', 'sample', 'hexbin']
+
+def use_headless_backend():
+    # Draw to image files only, without needing (or trying to open) a window. Must be called before any chart is made.
+    import matplotlib
+    matplotlib.use('Agg')
 
 def get_new_plot(name):
-    f = plt.figure(name)
+    import matplotlib.pyplot as plt
+    # Start from a blank figure even if one of the same name has been drawn before.
+    f = plt.figure(name, clear=True)
     return (f, f.subplots())
 
-def export_plot(path):
-    plt.savefig(path)
+def export_plot(path, figure=None):
+    import matplotlib.pyplot as plt
+    if figure is None:
+        figure = plt.gcf()
+    with profiling.stage('render'):
+        figure.savefig(path)
+
+def close_plot(figure):
+    import matplotlib.pyplot as plt
+    plt.close(figure)
 
 def render_plot():   
+    import matplotlib.pyplot as plt
     plt.show()
     
 def generate_piechart(sites, category='visits', th=0):
-    figure, axes = get_new_plot("HistoryLane Pie Chart")
-    # 3/13/24:
-    # This is inefficient, because it requires the Python runtime to copy the array whenever it expands past
-    # its bounds. However, because items in sites are often skipped for being None or being too small (an
-    # indeterminate number each time), it is not feasible to do fixed-length array allocation here to be lighter weight.
-    # Because matplotlib only accepts Python arrays, it doesn't make sense to use a more sensible data structure (e.g.,
-    # a linked list), because I would have to copy that into an array anyway, which is still computationally expensive.
-    visits = []
-    visit_labels = []
-    counter = 0
-    kuiper_belt = 0 
-    for i in sites:
-        if i is None: continue
-        if len(sites[i]) < th:
-            kuiper_belt += len(sites[i])
-            continue
-        
-        visits.append(len(sites[i]))
-        visit_labels.append(i)
-        counter += 1
-        
-    if kuiper_belt > 0:
-        visits.append(kuiper_belt)
-        visit_labels.append('Everything Else')
+    import aggregate
+    # 10/17/26: the counting and the "Everything Else" rollup are now done on whole arrays at once (see aggregate.py),
+    # in place of appending to Python lists one domain at a time.
+    with profiling.stage('aggregate'):
+        visit_labels, visits = aggregate.rollup(*aggregate.domain_counts(sites), th)
+        profiling.count(int(visits.sum()))
 
-    axes.pie(visits, labels=visit_labels)
-    plt.tight_layout()
+    with profiling.stage('render'):
+        figure, axes = get_new_plot("HistoryLane Pie Chart")
+        axes.pie(visits, labels=visit_labels)
+        figure.tight_layout()
+        profiling.count(len(visits))
+    return figure
 
 def generate_barchart(sites, label_by='title', th=0):
-    figure, axes = get_new_plot("HistoryLane Bar Chart")
-    axes.set_xticks(range(len(sites) + 1))
-    axes.set_yscale('log')
-    axes.tick_params(axis='x', labelrotation=90)
-    ticklabels = [None] * (len(sites) + 1)
-    counter = 0
-    kuiper_belt = 0
-    for i in sites:
-        if i is None: continue
-        if len(sites[i]) < th:
-            kuiper_belt += len(sites[i])
-            continue
-        
-        axes.bar(counter, len(sites[i]), label=i)
-        ticklabels[counter] = i
-        counter += 1
+    import numpy as np
+    import aggregate
+    with profiling.stage('aggregate'):
+        ticklabels, heights = aggregate.rollup(*aggregate.domain_counts(sites), th)
+        profiling.count(int(heights.sum()))
+
+    with profiling.stage('render'):
+        figure, axes = get_new_plot("HistoryLane Bar Chart")
+        positions = np.arange(len(heights))
+        axes.set_yscale('log')
+        axes.tick_params(axis='x', labelrotation=90)
+        # 10/17/26: this used to call axes.bar() once per domain, each call making its own set of artists; one call
+        # for every bar keeps rendering time from growing with each domain added.
+        axes.bar(positions, heights)
+        axes.set_xticks(positions, ticklabels)
+        figure.tight_layout()
+        profiling.count(len(heights))
+    return figure
 
-    if kuiper_belt > 0:
-        axes.bar(counter, kuiper_belt, label='Everything Else')
-        ticklabels[counter] = 'Everything Else'
-        
-    axes.set_xticklabels(ticklabels)
-    plt.tight_layout()
+def generate_scatterplot(sites, hcategory='counter', vcategory='duration', th=0, mode='auto', max_points=100_000,
+                         idle_gap=None, dwell_cap=None):
+    # 10/17/26: plotting every single visit is unusably slow once there are millions of them. mode is one of:
+    #    points: plot every visit
+    #    sample: plot at most max_points visits, chosen so that each domain keeps its share of the plot
+    #    hexbin: plot the density of visits in hexagonal bins, which copes with any number of visits
+    #    auto: points if there are no more than max_points visits, and sample otherwise
+    # idle_gap and dwell_cap (in seconds) govern how durations are estimated where the browser has not recorded them,
+    # and how visits are grouped into sessions; see aggregate.sessionize.
+    import numpy as np
+    import aggregate
+    # No category was chosen for an axis: plot against time.
+    hcategory = hcategory or 'time'
+    vcategory = vcategory or 'time'
 
-def generate_scatterplot(sites, hcategory='counter', vcategory='duration', th=0):
-    figure, axes = get_new_plot("HistoryLane Scatterplot")
-    xaxis = []
-    yaxis = []
-    # Removed the aggregate category for things falling below the threshold of notice - it doesn't make sense given this
-    # graph's purpose
-    # 11/3/23 - this used to call axes.xscale(), which now raises an AttributeError
-    # perhaps a version upgrade changed the API?
-    axes.set_xscale('log')
-    axes.set_yscale('log')
+    with profiling.stage('aggregate'):
+        # 10/17/26: every visit to a domain over the threshold goes into one call to axes.scatter(), coloured by
+        # domain, rather than one call per domain.
+        domain_ids, labels, values = aggregate.visit_columns(sites, {hcategory, vcategory},
+                                                             idle_gap or aggregate.IDLE_GAP,
+                                                             dwell_cap or aggregate.DWELL_CAP)
+        labels, counts = aggregate.domain_counts(sites)
+        shown = (counts >= th) & ~np.equal(labels, None)
+        # Only positive values can be placed on a logarithmic axis.
+        selected = np.flatnonzero(shown[domain_ids] & (values[hcategory] > 0) & (values[vcategory] > 0))
 
-    for i in sites:
-        if i is None: continue
-        if len(sites[i]) < th:
-            continue
-        
-        for j in sites[i]:
-            xaxis.append(j[hcategory])
-            yaxis.append(j[vcategory])
+        if mode == 'auto':
+            mode = 'points' if len(selected) <= max_points else 'sample'
+        if mode == 'sample':
+            selected = selected[aggregate.stratified_sample(domain_ids[selected], max_points)]
+        profiling.count(len(domain_ids))
 
-        axes.scatter(xaxis, yaxis)
+    with profiling.stage('render'):
+        figure, axes = get_new_plot("HistoryLane Scatterplot")
+        # Removed the aggregate category for things falling below the threshold of notice - it doesn't make sense
+        # given this graph's purpose
+        # 11/3/23 - this used to call axes.xscale(), which now raises an AttributeError
+        # perhaps a version upgrade changed the API?
+        axes.set_xscale('log')
+        axes.set_yscale('log')
 
-        xaxis = []
-        yaxis = []
+        if mode == 'hexbin':
+            density = axes.hexbin(values[hcategory][selected], values[vcategory][selected], xscale='log',
+                                  yscale='log', bins='log', mincnt=1, gridsize=100)
+            figure.colorbar(density, ax=axes, label='visits')
+        else:
+            axes.scatter(values[hcategory][selected], values[vcategory][selected], c=domain_ids[selected],
+                         cmap='tab20', s=4)
 
-    plt.tight_layout()
+        axes.set_xlabel(hcategory)
+        axes.set_ylabel(vcategory)
+        figure.tight_layout()
+        profiling.count(len(selected))
+    return figure
@@ -0,0 +1,139 @@
+# domains.py
+# One way of turning URLs into the domains that history is grouped by, shared by every browser.
+#
+# 10/17/26: each scraper used to work out domains its own way (Safari by slicing the URL, Firefox by reversing
+# rev_host, Vivaldi by taking url_for_deduping as it came, scheme and all), so the same website had a different name
+# in each browser, and the same string work was redone for every single visit. Here, a URL is reduced to its
+# registrable domain - the part of the host that was registered with a registrar, such as bbc.co.uk for
+# news.bbc.co.uk - according to the Public Suffix List, a copy of which is kept alongside this file so that no
+# network access is needed. Ports and login details are dropped, IP addresses are kept whole, and internationalized
+# domain names are shown in Unicode (bücher.de rather than xn--bcher-kva.de). Results are memoized, since browsing
+# history repeats the same few thousand hosts over and over.
+import functools
+import ipaddress
+import os.path
+
+PUBLIC_SUFFIX_LIST = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public_suffix_list.dat')
+
+# Number of distinct URLs and hosts whose domains are remembered
+CACHE_SIZE = 65536
+
+
+class PublicSuffixList:
+    # The rules of the list, in three kinds: ordinary rules (co.uk), wildcards (*.ck, stored here as ck), and
+    # exceptions to wildcards (!www.ck, stored as www.ck). See https://publicsuffix.org/list/ for the algorithm.
+    def __init__(self, path=PUBLIC_SUFFIX_LIST):
+        self.rules = set()
+        self.wildcards = set()
+        self.exceptions = set()
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                rule = line.strip().split(' ')[0]
+                if not rule or rule.startswith('//'):
+                    continue
+                if rule.startswith('!'):
+                    self.exceptions.add(rule[1:])
+                elif rule.startswith('*.'):
+                    self.wildcards.add(rule[2:])
+                else:
+                    self.rules.add(rule)
+
+    def suffix_length(self, labels):
+        # The number of labels at the end of labels that make up its public suffix
+        for i in range(len(labels)):
+            candidate = '.'.join(labels[i:])
+            if candidate in self.exceptions:
+                return len(labels) - i - 1
+            if candidate in self.rules:
+                return len(labels) - i
+            if i + 1 < len(labels) and '.'.join(labels[i + 1:]) in self.wildcards:
+                return len(labels) - i
+        # The implicit rule "*": an unlisted top-level domain
+        return 1
+
+    def registrable_domain(self, host):
+        # The public suffix plus one more label or, if host is itself a public suffix, host as it is.
+        labels = host.split('.')
+        length = self.suffix_length(labels) + 1
+        if length >= len(labels):
+            return host
+        return '.'.join(labels[-length:])
+
+
+@functools.lru_cache(maxsize=None)
+def suffix_list():
+    # The bundled list, read the first time it is needed.
+    return PublicSuffixList()
+
+
+def url_host(url):
+    # The host part of a URL, without login details or port, e.g. news.bbc.co.uk for
+    # https://user@news.bbc.co.uk:443/path. Returns None for URLs without one (about:blank, file:///..., etc.)
+    # This does by hand the little of urllib.parse.urlsplit() that is needed, which is a good deal quicker.
+    start = url.find('://')
+    if start == -1:
+        return None
+
+    end = len(url)
+    for i in '/?#':
+        position = url.find(i, start + 3)
+        if position != -1 and position < end:
+            end = position
+
+    host = url[start + 3:end].rpartition('@')[2]
+    if host.startswith('['):
+        # IPv6 address, e.g. http://[::1]:8000/
+        return host[1:host.find(']')] or None
+    if ':' in host:
+        host = host.rpartition(':')[0]
+    return host or None
+
+
+def unicode_host(host):
+    # Decode internationalized labels ("xn--...") so that a host is always spelt the same way.
+    if 'xn--' not in host:
+        return host
+    try:
+        return host.encode('ascii').decode('idna')
+    except UnicodeError:
+        return host
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def host_domain(host):
+    # The registrable domain of a host name, or the host itself if it is an IP address or has only one label
+    # (e.g. localhost). Returns None if there is no host to speak of.
+    if host is None:
+        return None
+
+    host = host.strip('.').lower()
+    if not host:
+        return None
+
+    try:
+        return str(ipaddress.ip_address(host))
+    except ValueError:
+        pass
+
+    host = unicode_host(host)
+    if '.' not in host:
+        return host
+    return suffix_list().registrable_domain(host)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def url_domain(url):
+    # The registrable domain of a URL, e.g. bbc.co.uk for https://news.bbc.co.uk/news. Returns None for URLs
+    # without a host.
+    if url is None:
+        return None
+    return host_domain(url_host(url))
+
+
+def url_domains(urls):
+    # The domain of each of a column of URLs, in a list of the same length and order. Each distinct URL is only
+    # looked at once, however often it appears.
+    unique = dict.fromkeys(urls)
+    for i in unique:
+        unique[i] = url_domain(i)
+    return [unique[i] for i in urls]
@@ -0,0 +1,86 @@
+# heavyhitters.py
+# The most visited domains, counted in a fixed amount of memory however many domains there are (see historylane.py's
+# --top-k option).
+#
+# 10/17/26: exact counts need a counter for every domain ever visited, though most of those are visited once or twice
+# and end up in "Everything Else" anyway. The Space-Saving algorithm (Metwally, Agrawal and El Abbadi, "Efficient
+# Computation of Frequent and Top-k Elements in Data Streams", 2005) keeps only a fixed number of counters. A domain
+# without a counter takes over the smallest one, count and all, and that count is recorded as the domain's error:
+# each count is then at most its error too high, and never too low. No error is more than the smallest count, which
+# is at most (visits counted) / (number of counters), so any domain visited more often than that is sure to have a
+# counter. The counts always add up to the number of visits counted.
+import collections
+import heapq
+import itertools
+import browserhandler
+
+# Items counted exactly, with a Counter, before being added to the summary together
+CHUNK_SIZE = 10_000
+
+class SpaceSaving:
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError('A summary needs at least one counter')
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.total = 0
+        # One (count, item) entry per counter, smallest first. Counts only ever go up, so an entry whose count is out
+        # of date is too small, and is only brought up to date when it reaches the top (see smallest).
+        self.heap = []
+
+    def smallest(self):
+        # The counter with the smallest count, brought up to date
+        while True:
+            count, item = self.heap[0]
+            if self.counts[item] == count:
+                return count, item
+            heapq.heapreplace(self.heap, (self.counts[item], item))
+
+    def add(self, item, count=1):
+        self.total += count
+        if item in self.counts:
+            self.counts[item] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = count
+            self.errors[item] = 0
+            heapq.heappush(self.heap, (count, item))
+        else:
+            smallest, evicted = self.smallest()
+            del self.counts[evicted]
+            del self.errors[evicted]
+            self.counts[item] = smallest + count
+            self.errors[item] = smallest
+            heapq.heapreplace(self.heap, (smallest + count, item))
+
+    def update(self, items):
+        # Count a stream of items. Repeats within each chunk of the stream are added up first, which is no less
+        # accurate, and a good deal quicker, than adding them one at a time.
+        items = iter(items)
+        while True:
+            chunk = collections.Counter(itertools.islice(items, CHUNK_SIZE))
+            if not chunk:
+                return
+            for item, count in chunk.items():
+                self.add(item, count)
+
+    def error_bound(self):
+        # The most that any count can be too high, and the most visits that an item without a counter can have had
+        if len(self.counts) < self.capacity:
+            return 0
+        return self.smallest()[0]
+
+    def top(self):
+        # [(item, count, error)], largest count first. An item's true count is between count - error and count.
+        return sorted(((item, count, self.errors[item]) for item, count in self.counts.items()),
+                      key=lambda i: (-i[1], i[2]))
+
+    def counter(self, threshold=0):
+        # A Counter of the items whose count is at least threshold, with everything else (the rest of the counters,
+        # and the visits of the items that lost theirs) added up into browserhandler.EVERYTHING_ELSE, as
+        # browserhandler.count_domains() returns.
+        counts = collections.Counter({item: count for item, count in self.counts.items() if count >= threshold})
+        rest = self.total - sum(counts.values())
+        if rest > 0:
+            counts[browserhandler.EVERYTHING_ELSE] = rest
+        return counts
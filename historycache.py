@@ -0,0 +1,332 @@
+# historycache.py
+# A local sidecar database of visits that have already been extracted, so that repeat runs only have to read the
+# visits a browser has recorded since the last one.
+import math
+import sqlite3
+import os
+import sys
+import browserhandler
+import domains
+import profiling
+
+if sys.platform == 'darwin':
+    CACHE_DIR = browserhandler.USER_DIR + '/Library/Caches/HistoryLane'
+elif sys.platform == 'win32':
+    CACHE_DIR = os.environ.get('LOCALAPPDATA', browserhandler.USER_DIR + '/AppData/Local') + '/HistoryLane/Cache'
+else:
+    CACHE_DIR = os.environ.get('XDG_CACHE_HOME', browserhandler.USER_DIR + '/.cache') + '/historylane'
+
+CACHE_DB = CACHE_DIR + '/cache.sqlite'
+
+# sources holds one row per browser and profile, along with the high-water mark: the largest browser visit ID that
+# has been copied into the cache. identity records which file on disk the visits came from; if the browser's database
+# is replaced (or the history is cleared), the cached rows no longer describe it and are thrown away.
+# visits holds the normalized rows described in browserhandler.py.
+# 10/17/26: domain_days is a rollup of visits: the number of visits to each domain on each day (UTC days, counted from
+# 1 January 2001, as Safari time is). It is kept up to date as visits are added, so that counting years of visits by
+# domain means adding up a few rows per domain and day, not reading every visit. Visits without a domain are left
+# out, as the charts leave them out.
+SCHEMA = '''
+create table if not exists sources (
+    id integer primary key,
+    browser text not null,
+    profile text not null,
+    identity text,
+    high_water integer not null default 0,
+    unique (browser, profile)
+);
+create table if not exists visits (
+    source integer not null,
+    visit_id integer not null,
+    domain text,
+    url text,
+    title text,
+    time real,
+    counter integer,
+    duration integer,
+    primary key (source, visit_id)
+);
+create index if not exists visits_by_url on visits (source, url);
+create index if not exists visits_by_time on visits (source, time);
+create table if not exists domain_days (
+    source integer not null,
+    domain text not null,
+    day integer not null,
+    visits integer not null,
+    primary key (source, domain, day)
+) without rowid;
+'''
+
+# The day of a row of visits, as SQL
+DAY = 'cast(time / 86400 as integer)'
+
+# 10/17/26: pages and page_text are for HistoryLane's search command. pages holds every URL that has been visited,
+# with the title it had most recently, and page_text is a full-text (FTS5) index of their titles and URLs, which the
+# triggers keep in step with pages; it stores no text of its own. Pages rather than visits are indexed since most
+# visits are to pages visited before: the index stays a fraction of the size, and only new pages need indexing. Words
+# are matched without regard to case or accents, and a match in the title counts for twice as much as one in the URL.
+# All of this is kept apart from SCHEMA since not every build of SQLite includes FTS5; without it, everything but
+# searching works as before.
+SEARCH_SCHEMA = [
+    """create table if not exists pages (
+        id integer primary key,
+        url text not null unique,
+        domain text,
+        title text
+    )""",
+    """create virtual table if not exists page_text using fts5 (
+        title, url, content = 'pages', content_rowid = 'id', tokenize = 'unicode61 remove_diacritics 2'
+    )""",
+    "insert into page_text (page_text, rank) values ('rank', 'bm25(2.0, 1.0)')",
+    """create trigger if not exists page_text_insert after insert on pages begin
+        insert into page_text (rowid, title, url) values (new.id, new.title, new.url);
+    end""",
+    """create trigger if not exists page_text_delete after delete on pages begin
+        insert into page_text (page_text, rowid, title, url) values ('delete', old.id, old.title, old.url);
+    end""",
+    """create trigger if not exists page_text_update after update of title, url on pages begin
+        insert into page_text (page_text, rowid, title, url) values ('delete', old.id, old.title, old.url);
+        insert into page_text (rowid, title, url) values (new.id, new.title, new.url);
+    end""",
+    # Each page already cached takes the title of its latest visit
+    """insert or ignore into pages (url, domain, title) select url, domain, title
+        from (select url, domain, title, max(time) from visits where url is not null group by url)""",
+]
+
+# Add a batch of (url, domain, title) to pages, or bring their titles up to date
+ADD_PAGES = ('insert into pages (url, domain, title) values (?, ?, ?) on conflict (url) do update set '
+             'title = excluded.title where excluded.title is not null and title is not excluded.title')
+
+# Add the visits selected by a condition on the visits table to the rollup
+ROLLUP = ('insert into domain_days (source, domain, day, visits) '
+          'select source, domain, ' + DAY + ', count(*) from visits where domain is not null and {condition} '
+          'group by 1, 2, 3 on conflict (source, domain, day) do update set visits = visits + excluded.visits')
+
+def match_expression(text):
+    # An FTS5 query for visits containing every word of text. Each word is quoted, so that punctuation (as in c++ or
+    # bbc.co.uk) is searched for rather than taken for FTS5 syntax; a word ending in * matches any word it begins.
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*') and len(word) > 1
+        terms.append('"%s"%s' % (word.rstrip('*' if prefix else '').replace('"', '""'), '*' if prefix else ''))
+    return ' '.join(terms)
+
+def source_identity(path):
+    # The device and inode of the database file: this survives the browser writing to it, but not its replacement.
+    info = os.stat(path)
+    return '%d:%d' % (info.st_dev, info.st_ino)
+
+class HistoryCache:
+    def __init__(self, path=None):
+        self.path = path or CACHE_DB
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Several threads may each have a connection open at once (see historylane.py); wait for one another's writes.
+        self.connection = profiling.trace(sqlite3.connect(self.path, timeout=60))
+        self.connection.executescript(SCHEMA)
+        self.searchable = self.create_search_index()
+
+    def create_search_index(self):
+        # Make the search index (see SEARCH_SCHEMA), if there is none, out of whatever visits are already cached.
+        # Returns False if this build of SQLite cannot.
+        # Several connections to the cache may be opened at once; the first to take the write lock makes the index,
+        # and the others find it there once they have the lock in turn.
+        exists = "select 1 from sqlite_master where name = 'page_text'"
+        if self.connection.execute(exists).fetchone() is not None:
+            return True
+        try:
+            # All at once or not at all, so that a failure cannot leave an index without its triggers
+            self.connection.execute('begin immediate')
+            if self.connection.execute(exists).fetchone() is None:
+                for i in SEARCH_SCHEMA:
+                    self.connection.execute(i)
+            self.connection.commit()
+        except sqlite3.OperationalError as e:
+            self.connection.rollback()
+            if 'fts5' not in str(e):
+                raise
+            return False
+        return True
+
+    def __get_source(self, browser, profile, source):
+        # Returns the cache's ID for a particular browser profile and its high-water mark, first discarding
+        # anything cached for it if the underlying database is no longer the one the cache was filled from.
+        identity = source_identity(source.path)
+        row = self.connection.execute('select id, identity, high_water from sources where browser = ? and profile = ?',
+                                      [browser, profile]).fetchone()
+        if row is None:
+            cursor = self.connection.execute('insert into sources (browser, profile, identity) values (?, ?, ?)',
+                                             [browser, profile, identity])
+            return cursor.lastrowid, 0
+
+        source_id, cached_identity, high_water = row
+        if cached_identity != identity or source.high_water() < high_water:
+            for i in ('visits', 'domain_days'):
+                self.connection.execute('delete from %s where source = ?' % i, [source_id])
+            if self.searchable:
+                # Pages whose every visit has just been thrown away must not be found by searching either
+                self.connection.execute('delete from pages where url not in '
+                                        '(select url from visits where url is not null)')
+            self.connection.execute('update sources set identity = ?, high_water = 0 where id = ?', [identity, source_id])
+            high_water = 0
+
+        return source_id, high_water
+
+    def update(self, browser, profile, source):
+        # Copy every visit newer than the high-water mark from the browser into the cache, a batch at a time.
+        # source is one of browserhandler's history objects (SafariHistory, FirefoxProfile, VivaldiProfile).
+        profile = profile or ''
+        with profiling.stage('extract'), self.connection:
+            source_id, high_water = self.__get_source(browser, profile, source)
+            for rows in source.iter_visits(since_id=high_water):
+                if len(rows) == 0:
+                    continue
+
+                self.connection.executemany(
+                    'insert or replace into visits (source, visit_id, domain, url, title, time, counter, duration) '
+                    'values (%d, ?, ?, ?, ?, ?, ?, ?)' % source_id, rows
+                )
+                # Every visit in the batch is newer than anything cached before, and batches are in order of visit
+                # ID, so the batch is exactly the visits between its first and last IDs.
+                self.connection.execute(ROLLUP.format(condition='source = ? and visit_id between ? and ?'),
+                                        [source_id, rows[0][0], rows[-1][0]])
+
+                # Visit counts belong to the URL, not to the visit, so they go stale as new visits arrive.
+                # Bring the counts of already-cached visits to those URLs up to date.
+                counters = {}
+                pages = {}
+                for visit_id, domain, url, title, time, counter, duration in rows:
+                    counters[url] = counter
+                    if url is not None:
+                        pages[url] = (url, domain, title)
+                if self.searchable:
+                    self.connection.executemany(ADD_PAGES, pages.values())
+
+                self.connection.executemany('update visits set counter = ? where source = %d and url = ?' % source_id,
+                                            [(counter, url) for url, counter in counters.items()])
+                high_water = rows[-1][0]
+
+            self.connection.execute('update sources set high_water = ? where id = ?', [high_water, source_id])
+
+        return source_id
+
+    def __visit_query(self, source_id, since=None, until=None):
+        # The cache stores times in Safari time; since and until are Unix times.
+        query = ('select visit_id, domain, url, title, time, counter, duration from visits where source = ?')
+        parameters = [source_id]
+        if since is not None:
+            query += ' and time >= ?'
+            parameters.append(since - browserhandler.SAFARI_EPOCH)
+        if until is not None:
+            query += ' and time < ?'
+            parameters.append(until - browserhandler.SAFARI_EPOCH)
+
+        return query, parameters
+
+    def iter_visits(self, browser, profile, source, batch_size=browserhandler.BATCH_SIZE, since=None, until=None,
+                    threshold=0, by_time=False):
+        # Bring the cache up to date, then stream its visits in batches of normalized rows, filtered and ordered in the
+        # same way as the browser's own iter_visits().
+        yield from self.iter_cached(self.update(browser, profile, source), batch_size, since, until, threshold, by_time)
+
+    def iter_cached(self, source_id, batch_size=browserhandler.BATCH_SIZE, since=None, until=None, threshold=0,
+                    by_time=False):
+        # As iter_visits(), but for the visits already cached for a source (an ID that update() has returned), without
+        # bringing them up to date first. Nothing is written, so several of these can be read at once.
+        query, parameters = self.__visit_query(source_id, since, until)
+        yield from browserhandler.select_visits(self.connection, query, parameters, threshold, batch_size,
+                                                'time' if by_time else 'visit_id')
+
+    def count_domains(self, browser, profile, source, since=None, until=None, threshold=0):
+        # Bring the cache up to date, then count its visits by domain (see browserhandler.count_domains).
+        # 10/17/26: every whole day in the time window is counted from domain_days; only visits on the partial days
+        # at either end of the window (if any) are counted one by one.
+        source_id = self.update(browser, profile, source)
+        start = None if since is None else since - browserhandler.SAFARI_EPOCH
+        end = None if until is None else until - browserhandler.SAFARI_EPOCH
+        first_day = None if start is None else math.ceil(start / 86400)
+        last_day = None if end is None else math.floor(end / 86400)  # the first day not wholly in the window
+
+        if first_day is not None and last_day is not None and first_day >= last_day:
+            # Not one whole day in the window
+            query, parameters = self.__visit_query(source_id, since, until)
+            return browserhandler.count_domains(self.connection, query, parameters, threshold)
+
+        query = 'select domain, visits from domain_days where source = ?'
+        parameters = [source_id]
+        edges = []  # the partial days
+        if first_day is not None:
+            query += ' and day >= ?'
+            parameters.append(first_day)
+            edges.append((start, first_day * 86400))
+        if last_day is not None:
+            query += ' and day < ?'
+            parameters.append(last_day)
+            edges.append((last_day * 86400, end))
+        for edge in edges:
+            query += ' union all select domain, 1 from visits where source = ? and time >= ? and time < ?'
+            parameters += [source_id, *edge]
+        return browserhandler.sum_domains(self.connection, query, parameters, threshold)
+
+    def search(self, text, source_ids=None, domain=None, since=None, until=None, limit=20, raw=False, window=None):
+        # The limit cached visits that best match text (words that must all appear in a title or URL; see
+        # match_expression, or, with raw, a query in FTS5's own syntax), best first and, among visits to the same
+        # page, latest first. The visits may be limited to those of certain sources (the IDs update() returns), of
+        # one domain, and between the Unix times since and until. With window, a visit that another of the sources
+        # recorded no more than window seconds earlier is left out, as browserhandler.merge_timelines leaves it out.
+        # 10/17/26: one statement. The best limit results are visits to at most the limit best pages that have a
+        # visit in the chosen sources and time window, so matches takes those pages from the index best first and
+        # stops there, and only their visits are looked up (visits_by_url, or visits_by_time for a short window) and
+        # sorted. Looking up each page's visits in a query of its own took longer than the search itself.
+        # Returns a list of (browser, profile, visit_id, domain, url, title, Unix time) tuples.
+        if not self.searchable:
+            raise RuntimeError('This build of SQLite has no full-text search (FTS5), which searching needs.')
+        if source_ids is None:
+            source_ids = [i for i, in self.connection.execute('select id from sources')]
+
+        # What a visit (in the table called {visits}) must satisfy to be searched
+        conditions = '{visits}.source in (%s)' % ', '.join('?' * len(source_ids))
+        visit_parameters = list(source_ids)
+        if since is not None:
+            conditions += ' and {visits}.time >= ?'
+            visit_parameters.append(since - browserhandler.SAFARI_EPOCH)
+        if until is not None:
+            conditions += ' and {visits}.time < ?'
+            visit_parameters.append(until - browserhandler.SAFARI_EPOCH)
+        searched = conditions.format(visits='visits')
+
+        query = ('with matches as materialized (select page_text.rowid, page_text.rank from page_text '
+                 'join pages on pages.id = page_text.rowid where page_text match ? '
+                 'and exists (select * from visits where visits.url = pages.url and %s)' % searched)
+        parameters = [text if raw else match_expression(text)] + visit_parameters
+        if domain is not None:
+            query += ' and pages.domain = ?'
+            parameters.append(domains.host_domain(domain))
+        query += (' order by page_text.rank limit ?) '
+                  'select sources.browser, sources.profile, visits.visit_id, visits.domain, visits.url, visits.title, '
+                  'visits.time + %d from matches join pages on pages.id = matches.rowid '
+                  'join visits on visits.url = pages.url and %s join sources on sources.id = visits.source'
+                  % (browserhandler.SAFARI_EPOCH, searched))
+        parameters += [limit] + visit_parameters
+        if window is not None:
+            # Of visits recorded at the same time, the one from the source added to the cache first is kept
+            query += (' where not exists (select * from visits as earlier where earlier.url = visits.url and %s '
+                      'and earlier.source != visits.source and earlier.time between visits.time - ? and visits.time '
+                      'and (earlier.time < visits.time or earlier.source < visits.source))'
+                      % conditions.format(visits='earlier'))
+            parameters += visit_parameters + [window]
+        query += ' order by matches.rank, visits.time desc limit ?'
+        parameters.append(limit)
+
+        try:
+            return self.connection.execute(query, parameters).fetchall()
+        except sqlite3.OperationalError as e:
+            if raw and ('fts5' in str(e) or 'no such column' in str(e)):
+                raise RuntimeError('%s is not a valid full-text query: %s' % (text, e)) from None
+            raise
+
+    def load(self, browser, profile, source, since=None, until=None, threshold=0):
+        # Bring the cache up to date, then return its visits as a VisitTable.
+        return browserhandler.collect_visits(
+            row for batch in self.iter_visits(browser, profile, source, since=since, until=until, threshold=threshold)
+            for row in batch
+        )
@@ -0,0 +1,58 @@
+# historyexport.py
+# Writes normalized history out as CSV or JSON Lines, for use elsewhere.
+import csv
+import gzip
+import json
+import sys
+import time
+import browserhandler
+
+FORMATS = ['csv', 'jsonl']
+
+# Columns of the exported file. time is a Unix time (seconds since midnight UTC on 1 January 1970) rather than the
+# Safari time used everywhere else, since that is what anything reading the file will expect.
+FIELDS = ['browser', 'profile', 'domain', 'url', 'title', 'time', 'counter', 'duration']
+
+def guess_format(path):
+    if path.endswith('.jsonl') or path.endswith('.jsonl.gz'):
+        return 'jsonl'
+    return 'csv'
+
+def open_output(path, compress):
+    if path == '-':
+        if compress:
+            return gzip.open(sys.stdout.buffer, 'wt', encoding='utf-8', newline='')
+        return open(sys.stdout.fileno(), 'w', encoding='utf-8', newline='', closefd=False)
+    if compress:
+        return gzip.open(path, 'wt', encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+def export_visits(streams, path, format=None, compress=None):
+    # streams yields (browser, profile, batches) for each profile to export, where batches is a stream of batches of
+    # normalized rows such as browserhandler's iter_visits() produces. Each batch is written out as soon as it
+    # arrives, so only one is ever held at a time.
+    # Returns the number of visits written and the number of seconds it took.
+    format = format or guess_format(path)
+    if compress is None:
+        compress = path.endswith('.gz')
+
+    rows = 0
+    start = time.perf_counter()
+    with open_output(path, compress) as output:
+        writer = csv.writer(output) if format == 'csv' else None
+        if writer is not None:
+            writer.writerow(FIELDS)
+
+        for browser, profile, batches in streams:
+            for batch in batches:
+                records = [
+                    (browser, profile, domain, url, title, visit_time + browserhandler.SAFARI_EPOCH, counter, duration)
+                    for visit_id, domain, url, title, visit_time, counter, duration in batch
+                ]
+                if writer is not None:
+                    writer.writerows(records)
+                else:
+                    output.write(''.join(json.dumps(dict(zip(FIELDS, i)), ensure_ascii=False) + '\n' for i in records))
+                rows += len(records)
+
+    return rows, time.perf_counter() - start
@@ -1,11 +1,39 @@
 #!/usr/bin/env python3
 # historylane.py
 # written by Robert Ryder, July 2023
-import browserhandler, chartgen
+import browserhandler, chartgen, heavyhitters, historycache, historyexport, historyserver, profiling
 import argparse
+import collections
+import datetime
+import os.path
+import re
 import sys
+import time
 
-POSSIBLE_CATEGORIES = [None, 'counter', 'time']
+POSSIBLE_CATEGORIES = [None, 'counter', 'time', 'duration', 'sessions']
+
+# Categories estimated from the times of the visits around each one, as aggregate.SESSION_CATEGORIES (aggregate.py is
+# only imported once a chart is drawn)
+SESSION_CATEGORIES = {'duration', 'sessions'}
+TIME_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+def parse_span(text):
+    # A length of time, either in seconds ("90") or with a unit ("30m", "2h"). Returns seconds.
+    span = re.fullmatch(r'(\d+(?:\.\d+)?)([smhdw]?)', text.strip())
+    if span is None:
+        raise argparse.ArgumentTypeError('%s is not a span of time such as 90, 30m or 2h' % text)
+    return float(span.group(1)) * TIME_UNITS.get(span.group(2), 1)
+
+def parse_time(text):
+    # Either a span of time before now ("24h", "14d", "2w") or a date/time ("2024-03-13", "2024-03-13T09:00").
+    # Returns a Unix time.
+    relative = re.fullmatch(r'(\d+(?:\.\d+)?)([smhdw])', text.strip())
+    if relative is not None:
+        return time.time() - float(relative.group(1)) * TIME_UNITS[relative.group(2)]
+    try:
+        return datetime.datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError('%s is neither a date nor a span of time such as 24h or 14d' % text)
 
 cmdline = argparse.ArgumentParser(sys.argv)
 cmdline.add_argument('-b', action=argparse.BooleanOptionalAction,
@@ -21,7 +49,7 @@ cmdline.add_argument('-p',
 cmdline.add_argument('-w',
                      dest='w',
                      type=str,
-                     help='Specify the web browser to analyze. Present options include Apple Safari, Mozilla Firefox, and Vivaldi.')
+                     help='Specify the web browser to analyze: one of %s, or "all" to combine every profile of every browser into one timeline.' % ', '.join(browserhandler.BACKENDS))
 
 cmdline.add_argument('-t',
                      dest='t',
@@ -29,80 +57,417 @@ cmdline.add_argument('-t',
                      default=10,
                      help='The minimum threshold of visits a website must have to be included in the final graph. Use this - as you like - to reduce the number of results; it makes graphs cleaner and more legible.')
 
+cmdline.add_argument('--since',
+                     dest='since',
+                     type=parse_time,
+                     help='Only include visits after this time: either a date (e.g., 2024-03-13) or a span of time before now (e.g., 24h, 14d, 2w). Safari defaults to the last 14 days.')
+
+cmdline.add_argument('--until',
+                     dest='until',
+                     type=parse_time,
+                     help='Only include visits before this time, given as for --since.')
+
 cmdline.add_argument('-f',
                      dest='output_file',
                      type=str,
-                     help='If supplied, the graph will be saved as an image to the provided filename.')
+                     help='If supplied, the graph will be saved as an image to the provided filename. When more than one graph is drawn, the name of each (bar, scatter, or pie) is added to the filename, e.g. report-bar.png.')
+
+cmdline.add_argument('--headless',
+                     action='store_true',
+                     help='Save graphs as images without displaying them or needing a display, e.g. on a server. Graphs are saved as with -f, or to historylane-bar.png, etc. if -f is not given.')
 
 cmdline.add_argument('-u',
                      dest='user_profile',
                      type=str,
                      help='For Mozilla Firefox- or Google Chrome-based browsers, this argument specifies the profile to use.')
 
+cmdline.add_argument('--all-profiles',
+                     dest='all_profiles',
+                     action='store_true',
+                     help='For Mozilla Firefox- or Google Chrome-based browsers, combine the history of every profile instead of using -u.')
+
 cmdline.add_argument('-c',
                      dest='user_category_a',
                      type=str,
                      default='counter',
-                     help='The category by which to organize the x-axis. This value also selects category in graphs (e.g., pie charts) where only one value is used. Defaults to "counter," or the number of visits to each site.')
+                     help='The category by which to organize the x-axis: counter, time, duration, or sessions. This value also selects category in graphs (e.g., pie charts) where only one value is used. Defaults to "counter," or the number of visits to each site.')
 
 cmdline.add_argument('-d',
                      dest='user_category_b',
                      type=str,
                      default=None,
-                     help='This selects the category by which the y-axis is organized.')
+                     help='This selects the category by which the y-axis is organized, from the same choices as -c.')
+
+# 10/17/26: only Chrome-based browsers record how long each visit lasted. For the others, "duration" is estimated
+# as the time until the next visit, and "sessions" is the number of browsing sessions in which a site was visited.
+cmdline.add_argument('--idle-gap',
+                     dest='idle_gap',
+                     type=parse_span,
+                     default=None,
+                     help='A pause between visits longer than this (e.g., 30m, the default) ends a browsing session, and the visit before it is not given a duration.')
+
+cmdline.add_argument('--dwell-cap',
+                     dest='dwell_cap',
+                     type=parse_span,
+                     default=None,
+                     help='The longest an estimated duration can be (e.g., 10m, the default).')
+
+cmdline.add_argument('--scatter-mode',
+                     dest='scatter_mode',
+                     choices=chartgen.SCATTER_MODES,
+                     default='auto',
+                     help='How to draw the scatterplot: every visit as a point ("points"), a sample of at most --max-points visits that keeps each website\'s share ("sample"), or the density of visits in hexagonal bins ("hexbin"). Defaults to "auto", which samples only when there are more visits than --max-points.')
+
+cmdline.add_argument('--max-points',
+                     dest='max_points',
+                     type=int,
+                     default=100_000,
+                     help='The most points the scatterplot will draw before sampling. Defaults to 100,000.')
+
+cmdline.add_argument('--top-k',
+                     dest='top_k',
+                     type=int,
+                     default=None,
+                     help='For pie and bar charts, count visits in one pass while keeping a count for at most this many websites (e.g., 1000), however many there are. The counts of the most visited websites may then be slightly too high; the most they can be off by is reported.')
+
+cmdline.add_argument('--no-cache',
+                     dest='cache',
+                     action='store_false',
+                     help='Read the whole history from the browser instead of only the visits added since the last run. Previously read visits are otherwise kept in a local cache.')
+
+cmdline.add_argument('--profile',
+                     action='store_true',
+                     help='Report the time, CPU time, rows and SQL statements of each stage of the run (discovering profiles, extracting, normalizing, aggregating and rendering) on standard error.')
+
+cmdline.add_argument('--profile-memory',
+                     dest='profile_memory',
+                     action='store_true',
+                     help='With --profile, also report the peak memory of each stage. Tracing memory slows everything down several times over, so the times reported alongside it are not to be relied upon; measure the two in separate runs.')
+
+cmdline.add_argument('--profile-trace',
+                     dest='profile_trace',
+                     default=None,
+                     help='With --profile, also write the figures, and a trace of every stage that chrome://tracing or Perfetto can display, to this JSON file.')
+
+# 10/17/26: besides drawing charts (the default), HistoryLane can do other things with the history it reads.
+# Options that pick the history to read (-w, -u, --since, etc.) go before the command's name.
+commands = cmdline.add_subparsers(dest='command', metavar='command')
+
+export_command = commands.add_parser('export', help='Write every visit to a CSV or JSON Lines file instead of drawing a graph.')
+export_command.add_argument('export_path',
+                            metavar='path',
+                            help='The file to write, or - for standard output. A name ending in .gz is compressed with gzip.')
+export_command.add_argument('--format',
+                            dest='export_format',
+                            choices=historyexport.FORMATS,
+                            default=None,
+                            help='csv or jsonl. Defaults to jsonl for names ending in .jsonl or .jsonl.gz, and csv otherwise.')
+export_command.add_argument('--gzip',
+                            dest='export_gzip',
+                            action='store_true',
+                            default=None,
+                            help='Compress the output with gzip, whatever its name.')
+
+serve_command = commands.add_parser('serve', help='Keep the history in memory, read new visits as the browser records them, and answer questions about it (counts of visits per domain, visits per day, and charts) over HTTP until interrupted.')
+serve_command.add_argument('--host',
+                           dest='serve_host',
+                           default=historyserver.DEFAULT_HOST,
+                           help='The address to listen on. Defaults to %s, i.e. this computer only.' % historyserver.DEFAULT_HOST)
+serve_command.add_argument('--port',
+                           dest='serve_port',
+                           type=int,
+                           default=historyserver.DEFAULT_PORT,
+                           help='The port to listen on. Defaults to %d.' % historyserver.DEFAULT_PORT)
+serve_command.add_argument('--interval',
+                           dest='serve_interval',
+                           type=parse_span,
+                           default=historyserver.DEFAULT_INTERVAL,
+                           help='How often to check the browser for new visits (e.g., 2, the default, or 1m).')
+
+search_command = commands.add_parser('search', help='Find the visits whose title or URL contains every one of some words, best matches first.')
+search_command.add_argument('search_text',
+                            metavar='word',
+                            nargs='+',
+                            help='A word to look for. Case and accents are ignored, and a word ending in * matches any word it begins (e.g., pyth*). Visits to websites of the browser(s) chosen with -w, between --since and --until, are searched.')
+search_command.add_argument('-k',
+                            dest='search_limit',
+                            type=int,
+                            default=20,
+                            help='The number of visits to list. Defaults to 20.')
+search_command.add_argument('--domain',
+                            dest='search_domain',
+                            default=None,
+                            help='Only list visits to this website (e.g., bbc.co.uk).')
+search_command.add_argument('--raw',
+                            dest='search_raw',
+                            action='store_true',
+                            help='Take the words as a query in SQLite FTS5\'s own syntax (e.g., "title:python NOT snake") rather than words to look for.')
 
 argv = cmdline.parse_args()
 
+if argv.profile or argv.profile_trace or argv.profile_memory:
+    profiling.enable(memory=argv.profile_memory)
+
+def report_profile():
+    # Print (and perhaps save) what --profile has measured.
+    if profiling.current is None:
+        return
+    profiling.current.print_summary()
+    if argv.profile_trace:
+        profiling.current.write_trace(argv.profile_trace)
+
 if argv.user_category_a not in POSSIBLE_CATEGORIES:
-    raise RuntimeError('Please select one of counter or time for -c')
+    raise RuntimeError('Please select one of counter, time, duration, or sessions for -c')
 
 if argv.user_category_b not in POSSIBLE_CATEGORIES:
-    raise RuntimeError('Please select one of counter or time for -d')
+    raise RuntimeError('Please select one of counter, time, duration, or sessions for -d')
 
-history = None
+if argv.top_k is not None and (argv.top_k < 1 or argv.s):
+    raise RuntimeError('--top-k must be at least 1, and only applies to pie and bar charts')
 
-# Decide whence to extract history data based on user input.
-if argv.w is None:
-    # No browser specified - can't do anything
-    raise RuntimeError('Please select a supported browser with the -w option.')
-
-elif argv.w.lower() == 'safari':
-    # User has asked for Safari, but we're not on a mac.
-    if sys.platform != 'darwin':
-        raise RuntimeError('Apple Safari is only supported on macOS.')
-    
-    history = browserhandler.get_all_safari_data()
-    
-elif argv.w.lower() == 'firefox':
-    # Firefox and Chrome-based browsers have history divided into distinct user profiles
-    # If one of these is not specified, we don't know what to access. Insist that the user make this explicit.
-    if not hasattr(argv, 'user_profile'):
-        raise RuntimeError('A profile is required when working with Mozilla Firefox. A list of profiles is available from Firefox\'s about:profiles page')
-    
-    history = browserhandler.get_all_firefox_data()
-    if argv.user_profile not in history:
+# 10/17/26: pie and bar charts only need to know how many visits each domain has had, which SQLite can count without
+# handing over the visits themselves. Only the scatterplot needs every visit in memory at once.
+counting = not argv.s
+
+# The visits of domains below the threshold are added up into "Everything Else" by SQLite when counting, but left out
+# of a table of visits altogether. Only the scatterplot can do without them; pie and bar charts drawn alongside it
+# need them for their "Everything Else", and apply the threshold themselves. Nor can they be left out when durations
+# or sessions are plotted, which are worked out from the times of every visit (see aggregate.sessionize).
+filtering = counting or not (argv.b or argv.p or SESSION_CATEGORIES & {argv.user_category_a, argv.user_category_b})
+
+def time_window(profile):
+    # The (since, until) Unix times to read visits between. Safari has a default window of its own.
+    since = argv.since if argv.since is not None else getattr(profile, 'since', None)
+    return since, argv.until
+
+def stream_profile(browser, name, profile, by_time=False, source_id=None):
+    # Returns the profile's visits within the time window, as a stream of batches of normalized rows. Given the
+    # profile's source_id in the cache (as HistoryCache.update() returns), the cache is read as it is, without being
+    # brought up to date first.
+    since, until = time_window(profile)
+    if argv.cache:
+        cache = historycache.HistoryCache()
+        if source_id is None:
+            source_id = cache.update(browser, name, profile)
+        return cache.iter_cached(source_id, since=since, until=until, by_time=by_time)
+    return profile.iter_visits(since=since, until=until, by_time=by_time)
+
+def read_timeline(sources):
+    # sources is a {(browser, name): profile} mapping. Returns every source's visits merged into one timeline (see
+    # browserhandler.merge_timelines), with the sources read side by side, each on a thread of its own. Each stream
+    # is opened on the thread that reads it, since that is the only thread allowed to use its cache connection.
+    # 10/17/26: the cache is brought up to date for every source, one after another, before any of them is read. A
+    # stream waiting for the merge to catch up holds its read of the cache open, and while it does, no other source
+    # can save its new visits; the merge would then wait forever for that source's first batch.
+    source_ids = {}
+    if argv.cache:
+        cache = historycache.HistoryCache()
+        source_ids = {(browser, name): cache.update(browser, name, profile)
+                      for (browser, name), profile in sources.items()}
+
+    streams = []
+    for (browser, name), profile in sources.items():
+        opener = lambda browser=browser, name=name, profile=profile: stream_profile(
+            browser, name, profile, True, source_ids.get((browser, name)))
+        streams.append((browser, name, browserhandler.prefetch(opener)))
+    return browserhandler.merge_timelines(streams)
+
+def read_profile(browser, name, profile, threshold=0):
+    # Returns the profile's visits within the time window: a Counter of visits per domain when counting, and
+    # otherwise a VisitTable. Below-threshold domains are left to SQLite to filter out (or add up) too.
+    # Profiles may be read from several threads at once, and each needs its own connection to the cache.
+    since, until = time_window(profile)
+    if counting:
+        if argv.cache:
+            return historycache.HistoryCache().count_domains(browser, name, profile, since=since, until=until,
+                                                            threshold=threshold)
+        return profile.count_domains(since=since, until=until, threshold=threshold)
+
+    if argv.cache:
+        return historycache.HistoryCache().load(browser, name, profile, since=since, until=until, threshold=threshold)
+    return browserhandler.collect_visits(
+        row for batch in profile.iter_visits(since=since, until=until, threshold=threshold) for row in batch
+    )
+
+def read_profiles(browser, profiles):
+    # profiles is a {name: profile} mapping, none of which have been read yet. A lone profile is read with the
+    # threshold applied by SQLite (if filtering); several are read at once, and as a domain's visits may be spread
+    # over more than one of them, the threshold can only be applied once they have been combined (which the charts do
+    # themselves).
+    if len(profiles) == 1:
+        name, profile = next(iter(profiles.items()))
+        return read_profile(browser, name, profile, threshold=argv.t if filtering else 0)
+
+    if argv.cache:
+        # Made (or brought up to date) here, once, rather than by every thread at the same time
+        historycache.HistoryCache()
+    load = lambda name, profile: read_profile(browser, name, profile)
+    if counting:
+        return sum(browserhandler.map_profiles(profiles, load), collections.Counter())
+    return browserhandler.load_profiles(profiles, load)
+
+def count_top_domains(rows):
+    # Count visits per domain among a stream of normalized rows, keeping only argv.top_k counters (see
+    # heavyhitters.py). Returns a Counter, as read_profiles() does when counting.
+    summary = heavyhitters.SpaceSaving(argv.top_k)
+    with profiling.stage('aggregate'):
+        summary.update(row[1] for row in rows if row[1] is not None)
+        profiling.count(summary.total)
+    counts = summary.counter(argv.t)
+    uncertain = sum(1 for domain, count, error in summary.top() if count >= argv.t and count - error < argv.t)
+    print('Counted %d visits with %d counters: no count is more than %d too high%s' % (
+        summary.total, argv.top_k, summary.error_bound(),
+        '; %d of the websites shown may have had fewer than %d visits' % (uncertain, argv.t) if uncertain else ''),
+        file=sys.stderr)
+    return counts
+
+def select_profiles(profiles):
+    # The profile asked for with -u or, with --all-profiles, all of them.
+    if argv.all_profiles:
+        return profiles
+
+    if argv.user_profile not in profiles:
         raise RuntimeError('The specified profile does not exist')
-    
-    history = history[argv.user_profile].entries
-    
-elif argv.w.lower() == 'vivaldi':
-    if not hasattr(argv, 'user_profile'):
-        raise RuntimeError('A user profile must be provided with -u when analyzing Google Chrome-based browsers')
-
-    if argv.user_profile not in browserhandler.VivaldiProfile.get_all_profile_names():
-        raise RuntimeError('The specified user profile does not exist')
-    
-    history = browserhandler.get_all_vivaldi_data()[argv.user_profile].entries
-    
+
+    return {argv.user_profile: profiles[argv.user_profile]}
+
+profiles = None
+
+# Decide whence to extract history data based on user input.
+# 10/17/26: from the browsers in browserhandler.BACKENDS, rather than one branch per browser.
+with profiling.stage('discover'):
+    if argv.w is None:
+        # No browser specified - can't do anything
+        raise RuntimeError('Please select a supported browser with the -w option.')
+
+    browser = argv.w.lower()
+    if browser == 'all':
+        # Every profile of every browser; here, profiles is keyed by (browser, profile name)
+        profiles = browserhandler.get_all_sources()
+        if len(profiles) == 0:
+            raise RuntimeError('No browser history was found on this computer.')
+
+    elif browser not in browserhandler.BACKENDS:
+        raise RuntimeError('Please select a supported browser with the -w option: one of %s, or all.'
+                           % ', '.join(browserhandler.BACKENDS))
+
+    else:
+        backend = browserhandler.BACKENDS[browser]
+        if backend.PLATFORMS is not None and sys.platform not in backend.PLATFORMS:
+            # e.g. Safari, when we're not on a mac
+            raise RuntimeError('%s is not available on this computer.' % backend.LABEL)
+
+        if backend.HAS_PROFILES:
+            # Firefox and Chrome-based browsers have history divided into distinct user profiles
+            # If one of these is not specified, we don't know what to access. Insist that the user make this explicit.
+            if argv.user_profile is None and not argv.all_profiles:
+                raise RuntimeError(backend.PROFILE_REQUIRED)
+            profiles = select_profiles(backend.all_profiles())
+        else:
+            profiles = backend.all_profiles()
+
+if argv.command == 'export':
+    # Stream every visit out to a file, one profile after another (or in order of time, for all browsers), without
+    # ever holding the whole history.
+    if browser == 'all':
+        streams = browserhandler.split_timeline(read_timeline(profiles))
+    else:
+        streams = ((browser, name, stream_profile(browser, name, profile)) for name, profile in profiles.items())
+    with profiling.stage('export'):
+        rows, seconds = historyexport.export_visits(streams, argv.export_path, argv.export_format, argv.export_gzip)
+        profiling.count(rows)
+    print('Exported %d visits in %.2f seconds (%d visits per second)' % (rows, seconds, rows / seconds if seconds else 0),
+          file=sys.stderr)
+    report_profile()
+    sys.exit()
+
+if argv.command == 'search':
+    # 10/17/26: searched in the cache's full-text index, which is brought up to date first (see historycache.py), so
+    # only visits recorded since the last run are read from the browsers.
+    if not argv.cache:
+        raise RuntimeError('Searching uses the cache, so it cannot be combined with --no-cache.')
+    sources = profiles if browser == 'all' else {(browser, name): profile for name, profile in profiles.items()}
+    cache = historycache.HistoryCache()
+    source_ids = [cache.update(source_browser, name, profile) for (source_browser, name), profile in sources.items()]
+    with profiling.stage('search'):
+        start = time.perf_counter()
+        # With -w all, a visit recorded by more than one browser is listed once, as it is counted once
+        window = browserhandler.DUPLICATE_WINDOW if browser == 'all' else None
+        results = cache.search(' '.join(argv.search_text), source_ids, domain=argv.search_domain, since=argv.since,
+                               until=argv.until, limit=argv.search_limit, raw=argv.search_raw, window=window)
+        seconds = time.perf_counter() - start
+        profiling.count(len(results))
+    for source_browser, name, visit_id, domain, url, title, visited in results:
+        print('%s  %s  %s' % (datetime.datetime.fromtimestamp(visited).strftime('%Y-%m-%d %H:%M'), domain or '-',
+                              title or url))
+        print('    %s  (%s)' % (url, ' '.join(filter(None, [source_browser, name]))))
+    print('%d visits found in %.1f ms' % (len(results), seconds * 1000), file=sys.stderr)
+    report_profile()
+    sys.exit()
+
+if argv.command == 'serve':
+    # Everything is read straight from the browser: the server holds the whole history itself, and has no need of
+    # the cache. Only --since limits what is held; since and until can be given with each request instead.
+    sources = profiles if browser == 'all' else {(browser, name): profile for name, profile in profiles.items()}
+    historyserver.serve(sources, parse_time, since=argv.since, threshold=argv.t, host=argv.serve_host,
+                        port=argv.serve_port, interval=argv.serve_interval, idle_gap=argv.idle_gap,
+                        dwell_cap=argv.dwell_cap, deduplicate=browser == 'all')
+    sys.exit()
+
+if argv.top_k is not None:
+    # One pass over every visit, in fixed memory
+    if browser == 'all':
+        rows = browserhandler.timeline_rows(read_timeline(profiles))
+    else:
+        rows = (row for name, profile in profiles.items() for batch in stream_profile(browser, name, profile)
+                for row in batch)
+    history = count_top_domains(rows)
+elif browser == 'all':
+    # Charts apply the threshold themselves, once every browser's visits have been combined.
+    if counting:
+        history = collections.Counter(row[1] for row in browserhandler.timeline_rows(read_timeline(profiles))
+                                      if row[1] is not None)
+    else:
+        history = browserhandler.collect_timeline(read_timeline(profiles))
 else:
-    raise RuntimeError('Please select a supported browser with the -w option.')
+    history = read_profiles(browser, profiles)
+
+def chart_path(chart, count):
+    # Where to save a chart: the -f filename itself if it is the only chart, and otherwise that filename with the
+    # chart's name added.
+    if argv.output_file is None:
+        return 'historylane-%s.png' % chart
+    if count == 1:
+        return argv.output_file
+    root, extension = os.path.splitext(argv.output_file)
+    return '%s-%s%s' % (root, chart, extension or '.png')
+
+if argv.headless:
+    chartgen.use_headless_backend()
 
 # Generate the specified chart
+figures = []
 if argv.b:
-    chartgen.generate_barchart(history, th=argv.t) 
+    figures.append(('bar', chartgen.generate_barchart(history, th=argv.t)))
 if argv.s:
-    chartgen.generate_scatterplot(history, hcategory=argv.user_category_a, vcategory=argv.user_category_b, th=argv.t)
+    figures.append(('scatter', chartgen.generate_scatterplot(history, hcategory=argv.user_category_a,
+                                                             vcategory=argv.user_category_b, th=argv.t,
+                                                             mode=argv.scatter_mode, max_points=argv.max_points,
+                                                             idle_gap=argv.idle_gap, dwell_cap=argv.dwell_cap)))
 if argv.p:
-    chartgen.generate_piechart(history, category=argv.user_category_a, th=argv.t)
+    figures.append(('pie', chartgen.generate_piechart(history, category=argv.user_category_a, th=argv.t)))
+
+if argv.output_file is not None or argv.headless:
+    for chart, figure in figures:
+        chartgen.export_plot(chart_path(chart, len(figures)), figure)
+
+if profiling.current is not None and not argv.headless:
+    # Otherwise the figures would only be drawn once they are on screen, where the time taken cannot be told apart
+    # from the time spent looking at them.
+    for chart, figure in figures:
+        with profiling.stage('render'):
+            figure.canvas.draw()
+report_profile()
 
-chartgen.render_plot()
+if figures and not argv.headless:
+    chartgen.render_plot()
@@ -0,0 +1,376 @@
+# historyserver.py
+# "historylane.py serve": a long-running HistoryLane that keeps history in memory and answers questions about it
+# over HTTP, so that dashboards need not start Python, import matplotlib and read every database on each refresh.
+#
+# 10/17/26: every visit of the chosen profiles is read once, into one VisitTable. A thread then watches each
+# browser's database file, and its write-ahead log (which is where SQLite puts new visits until it next copies
+# them into the database proper), and reads any visits newer than those already held whenever either changes.
+# Requests are answered from memory by NumPy, using the table's columns as they are, and charts are drawn with the
+# Agg backend. Everything is served on 127.0.0.1 unless told otherwise: browsing history is nobody else's business.
+# With -w all, the same visit recorded by more than one browser (see browserhandler.DUPLICATE_WINDOW) is held once,
+# as the command line counts it.
+#
+#    GET /sources                 the profiles being served, with their number of visits
+#    GET /domains                 visits per domain, most visited first
+#    GET /timeline                visits per day (or per width seconds)
+#    GET /chart/pie.png           the charts, as drawn by historylane.py -p, -b and -s
+#    GET /chart/bar.png
+#    GET /chart/scatter.png
+#
+# Each takes the query parameters since and until (a date, a span of time before now such as 7d, or a Unix
+# time), browser and profile (to pick some of the profiles being served), and threshold (as for -t). /domains also
+# takes limit, /timeline width, and /chart/scatter.png x, y, mode and max_points (as for -c, -d, --scatter-mode
+# and --max-points).
+import http.server
+import io
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+import browserhandler
+import chartgen
+import visittable
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Seconds between checks of the browsers' database files
+DEFAULT_INTERVAL = 2.0
+
+def file_signature(path):
+    # Changes whenever the database, or its write-ahead log, is written to.
+    signature = []
+    for i in (path, path + '-wal'):
+        try:
+            info = os.stat(i)
+            signature.append((info.st_mtime_ns, info.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+class LiveHistory:
+    # Every visit of a number of profiles, in one VisitTable kept up to date as the browsers record more.
+    # sources is a {(browser, profile name): profile} mapping; since, if given, is the Unix time of the earliest
+    # visit to hold. With deduplicate, a visit that another profile has already recorded is left out, as
+    # browserhandler.merge_timelines leaves it out.
+    # The table is only ever added to, by one thread at a time, with lock held; readers hold it too while they use
+    # the table's columns, since an array cannot grow while NumPy is looking at it.
+    def __init__(self, sources, since=None, deduplicate=False):
+        self.sources = sources
+        self.keys = list(sources)
+        self.since = since
+        self.deduplicate = deduplicate and len(sources) > 1
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        # (Re)read every profile from the beginning, into a new table that takes the old one's place once complete.
+        # Each visit's source ID in the table is the position of its profile in self.keys.
+        table, high_water, signatures = visittable.VisitTable(), {}, {}
+        if self.deduplicate:
+            # 10/17/26: the profiles are read side by side in order of time and merged, so that a visit is held
+            # from whichever profile recorded it first. The table is nobody else's until it is complete.
+            streams = []
+            for number, key in enumerate(self.keys):
+                signatures[key] = file_signature(self.sources[key].path)
+                high_water[key] = 0
+                streams.append((key[0], key[1], self.read_by_time(key, high_water)))
+            numbers = {key: number for number, key in enumerate(self.keys)}
+            for batch in browserhandler.merge_timelines(streams):
+                for browser, profile, row in batch:
+                    table.append(*row, source=numbers[(browser, profile)])
+        else:
+            for number, key in enumerate(self.keys):
+                signatures[key] = file_signature(self.sources[key].path)
+                high_water[key] = self.ingest(table, number, key, 0)
+        with self.lock:
+            self.table = table
+            self.high_water = high_water
+            self.signatures = signatures
+            self.updated = time.time()
+
+    def read_by_time(self, key, high_water):
+        # The profile's visits in order of time, in batches, keeping high_water[key] at the largest visit ID read
+        # (whether or not the visit is then left out as a duplicate)
+        for batch in self.sources[key].iter_visits(since=self.since, by_time=True):
+            if len(batch) != 0:
+                high_water[key] = max(high_water[key], max(row[0] for row in batch))
+            yield batch
+
+    def ingest(self, table, number, key, since_id):
+        # Add the profile's visits newer than since_id to table. Returns the new high-water mark.
+        for batch in self.sources[key].iter_visits(since_id=since_id, since=self.since):
+            if len(batch) == 0:
+                continue
+            with self.lock:
+                table.extend(self.without_duplicates(table, batch, number) if self.deduplicate else batch, number)
+            since_id = max(since_id, batch[-1][0])
+        return since_id
+
+    def without_duplicates(self, table, batch, number):
+        # The visits in batch, from the profile at position number, other than those to a URL that table holds a
+        # visit to from another profile no more than DUPLICATE_WINDOW seconds before or after. Call with lock held.
+        import numpy as np
+        import aggregate
+        url_ids = {table.urls.index[row[2]] for row in batch if row[2] in table.urls.index}
+        if len(url_ids) == 0:
+            return batch
+        held_url_ids = aggregate.column(table.url_ids, np.int32)
+        held = np.isin(held_url_ids, list(url_ids)) & (aggregate.column(table.source_ids, np.int32) != number)
+        times = {}
+        for url_id, time in zip(held_url_ids[held].tolist(), aggregate.column(table.times, np.float64)[held].tolist()):
+            times.setdefault(url_id, []).append(time)
+        return [row for row in batch
+                if not any(abs(row[4] - i) <= browserhandler.DUPLICATE_WINDOW
+                           for i in times.get(table.urls.index.get(row[2]), ()))]
+
+    def refresh(self):
+        # Read whatever the browsers have recorded since last time. Returns the number of visits added (which is less
+        # than 0 if history was cleared).
+        before = self.table.row_count()
+        for number, key in enumerate(self.keys):
+            source = self.sources[key]
+            signature = file_signature(source.path)
+            if signature == self.signatures[key]:
+                continue
+
+            self.signatures[key] = signature
+            source.discard_snapshot()
+            if source.high_water() < self.high_water[key]:
+                # History was cleared: nothing held can be trusted to still be there.
+                self.load()
+                return self.table.row_count() - before
+            self.high_water[key] = self.ingest(self.table, number, key, self.high_water[key])
+
+        if self.table.row_count() != before:
+            self.updated = time.time()
+        return self.table.row_count() - before
+
+    def mask(self, since=None, until=None, sources=None):
+        # An array of booleans picking the visits between the Unix times since and until and from the profiles at
+        # the given positions in self.keys, or None if every visit is wanted. Call with lock held.
+        import numpy as np
+        import aggregate
+        mask = None
+        if since is not None or until is not None:
+            times = aggregate.column(self.table.times, np.float64)
+            mask = np.ones(len(times), dtype=bool)
+            if since is not None:
+                mask &= times >= since - browserhandler.SAFARI_EPOCH
+            if until is not None:
+                mask &= times < until - browserhandler.SAFARI_EPOCH
+        if sources is not None and len(sources) != len(self.keys):
+            picked = np.isin(aggregate.column(self.table.source_ids, np.int32), sources)
+            mask = picked if mask is None else mask & picked
+        return mask
+
+    def domain_counts(self, since=None, until=None, sources=None):
+        # Returns (labels, counts), as aggregate.domain_counts() does, for the visits chosen as for mask().
+        import numpy as np
+        import aggregate
+        with self.lock:
+            mask = self.mask(since, until, sources)
+            labels = np.array(self.table.domains.values, dtype=object)
+            if mask is None:
+                return labels, aggregate.column(self.table.domain_counts, np.int64).copy()
+            domain_ids = aggregate.column(self.table.domain_ids, np.int32)[mask]
+            return labels, np.bincount(domain_ids, minlength=len(labels))
+
+    def snapshot(self, since=None, until=None, sources=None):
+        # A VisitTable of the visits chosen as for mask(), which can be used once lock is let go.
+        import aggregate
+        with self.lock:
+            return aggregate.select_rows(self.table, self.mask(since, until, sources))
+
+    def summary(self):
+        import numpy as np
+        import aggregate
+        with self.lock:
+            visits = np.bincount(aggregate.column(self.table.source_ids, np.int32), minlength=len(self.keys))
+            return [{'browser': browser, 'profile': profile, 'visits': int(visits[i]),
+                     'high_water': self.high_water[(browser, profile)]}
+                    for i, (browser, profile) in enumerate(self.keys)]
+
+
+def watch(history, interval):
+    # Keep history up to date, for as long as the program runs.
+    while True:
+        time.sleep(interval)
+        try:
+            added = history.refresh()
+            if added > 0:
+                print('Read %d new visits' % added, file=sys.stderr)
+            elif added < 0:
+                print('History was cleared; %d visits are left' % history.table.row_count(), file=sys.stderr)
+        except Exception as e:
+            # e.g. the database is locked while the browser writes to it; try again next time
+            print('Could not read new visits: %s' % e, file=sys.stderr)
+
+
+class BadRequest(Exception):
+    pass
+
+
+class HistoryHandler(http.server.BaseHTTPRequestHandler):
+    # The server's history, parse_time (to read since and until), default threshold, and the idle gap and dwell cap
+    # for the scatterplot are set by serve().
+    history = None
+    parse_time = None
+    threshold = 0
+    idle_gap = None
+    dwell_cap = None
+    # matplotlib is not made to be used from several threads at once
+    chart_lock = threading.Lock()
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        routes = {
+            '/sources': self.sources,
+            '/domains': self.domains,
+            '/timeline': self.timeline,
+            '/chart/pie.png': self.piechart,
+            '/chart/bar.png': self.barchart,
+            '/chart/scatter.png': self.scatterplot,
+        }
+        if url.path not in routes:
+            return self.send_json({'error': 'No such page; try one of %s' % ', '.join(routes)}, 404)
+
+        query = {name: values[-1] for name, values in urllib.parse.parse_qs(url.query).items()}
+        try:
+            routes[url.path](query)
+        except BadRequest as e:
+            self.send_json({'error': str(e)}, 400)
+
+    def send_body(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, value, status=200):
+        self.send_body(json.dumps(value, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8', status)
+
+    # Query parameters
+
+    def number(self, query, name, default, kind=int):
+        try:
+            return kind(query[name]) if name in query else default
+        except ValueError:
+            raise BadRequest('%s must be a number' % name) from None
+
+    def time(self, query, name):
+        if name not in query:
+            return None
+        try:
+            return float(query[name])
+        except ValueError:
+            pass
+        try:
+            return self.parse_time(query[name])
+        except Exception as e:
+            raise BadRequest(str(e)) from None
+
+    def selection(self, query):
+        # (since, until, sources), for LiveHistory.mask()
+        sources = [i for i, (browser, profile) in enumerate(self.history.keys)
+                   if query.get('browser', browser) == browser and query.get('profile', profile) == profile]
+        if len(sources) == 0:
+            raise BadRequest('No such browser or profile is being served')
+        return self.time(query, 'since'), self.time(query, 'until'), sources
+
+    # Pages
+
+    def sources(self, query):
+        self.send_json({'updated': self.history.updated, 'sources': self.history.summary()})
+
+    def domains(self, query):
+        import numpy as np
+        import aggregate
+        labels, counts = self.history.domain_counts(*self.selection(query))
+        labels, counts = aggregate.rollup(labels, counts, self.number(query, 'threshold', self.threshold))
+        order = np.argsort(-counts, kind='stable')[:self.number(query, 'limit', None)]
+        self.send_json({'visits': int(counts.sum()),
+                        'domains': [{'domain': labels[i], 'visits': int(counts[i])} for i in order]})
+
+    def timeline(self, query):
+        import aggregate
+        width = self.number(query, 'width', 86400, float)
+        if width <= 0:
+            raise BadRequest('width must be more than 0')
+        starts, counts = aggregate.time_buckets(self.history.snapshot(*self.selection(query)), width)
+        self.send_json({'width': width, 'buckets': [{'start': float(start) + browserhandler.SAFARI_EPOCH,
+                                                     'visits': int(count)} for start, count in zip(starts, counts)]})
+
+    def send_chart(self, draw):
+        with self.chart_lock:
+            figure = draw()
+            image = io.BytesIO()
+            chartgen.export_plot(image, figure)
+            chartgen.close_plot(figure)
+        self.send_body(image.getvalue(), 'image/png')
+
+    def piechart(self, query):
+        counts = self.history.domain_counts(*self.selection(query))
+        threshold = self.number(query, 'threshold', self.threshold)
+        self.send_chart(lambda: chartgen.generate_piechart(dict_of_counts(*counts), th=threshold))
+
+    def barchart(self, query):
+        counts = self.history.domain_counts(*self.selection(query))
+        threshold = self.number(query, 'threshold', self.threshold)
+        self.send_chart(lambda: chartgen.generate_barchart(dict_of_counts(*counts), th=threshold))
+
+    def scatterplot(self, query):
+        for i in ('x', 'y'):
+            if query.get(i) not in (None, 'counter', 'time', 'duration', 'sessions'):
+                raise BadRequest('%s must be one of counter, time, duration, or sessions' % i)
+        if query.get('mode', 'auto') not in chartgen.SCATTER_MODES:
+            raise BadRequest('mode must be one of %s' % ', '.join(chartgen.SCATTER_MODES))
+
+        table = self.history.snapshot(*self.selection(query))
+        threshold = self.number(query, 'threshold', self.threshold)
+        max_points = self.number(query, 'max_points', 100_000)
+        self.send_chart(lambda: chartgen.generate_scatterplot(table, query.get('x', 'counter'), query.get('y'),
+                                                              th=threshold, mode=query.get('mode', 'auto'),
+                                                              max_points=max_points, idle_gap=self.idle_gap,
+                                                              dwell_cap=self.dwell_cap))
+
+
+def dict_of_counts(labels, counts):
+    # The Counter of visits per domain that the pie and bar charts take
+    import collections
+    return collections.Counter({label: int(count) for label, count in zip(labels, counts) if count > 0})
+
+
+def serve(sources, parse_time, since=None, threshold=0, host=DEFAULT_HOST, port=DEFAULT_PORT,
+          interval=DEFAULT_INTERVAL, idle_gap=None, dwell_cap=None, deduplicate=False):
+    # Serve the history of sources ({(browser, profile name): profile}) until interrupted. deduplicate is as for
+    # LiveHistory.
+    chartgen.use_headless_backend()
+    # Import these now rather than on the first request
+    import matplotlib.pyplot
+    import aggregate
+
+    start = time.perf_counter()
+    history = LiveHistory(sources, since, deduplicate)
+    print('Read %d visits from %d profiles in %.2f seconds' % (history.table.row_count(), len(sources),
+                                                                time.perf_counter() - start), file=sys.stderr)
+    threading.Thread(target=watch, args=(history, interval), daemon=True).start()
+
+    HistoryHandler.history = history
+    HistoryHandler.parse_time = staticmethod(parse_time)
+    HistoryHandler.threshold = threshold
+    HistoryHandler.idle_gap = idle_gap
+    HistoryHandler.dwell_cap = dwell_cap
+    server = http.server.ThreadingHTTPServer((host, port), HistoryHandler)
+    print('Serving history on http://%s:%d/' % (host, server.server_address[1]), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,161 @@
+# profiling.py
+# Where the time goes in a run of HistoryLane, stage by stage (see historylane.py's --profile option).
+#
+# 10/17/26: code marks out the stage it is in with "with profiling.stage('extract'):", says how many rows it has
+# dealt with through profiling.count(), and hands its database connections to profiling.trace() so that SQL
+# statements can be counted. Until enable() is called, all three do nothing at all, so that ordinary runs pay
+# (almost) nothing for them.
+# Stages may be nested. Each stage is only charged for its own time, not the time of the stages inside it: reading
+# rows from SQLite is "extract" even when it happens inside "normalize" building a VisitTable out of them. Profiles
+# read from several threads at once each keep their own stages, and their times are added together, so the stages'
+# wall-clock times may add up to more than the run took.
+# Peak memory is only measured if asked for (enable(memory=True)): tracemalloc makes everything it traces several times
+# slower, so the times taken alongside it say little about a run without it. Measure the two in separate runs, as
+# benchmark.py does.
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+# The usual stages, in the order they happen; the summary lists them in this order, and any others after them.
+STAGES = ['discover', 'extract', 'normalize', 'aggregate', 'render', 'export']
+
+# The Profiler in use, if any
+current = None
+
+DISABLED = contextlib.nullcontext()
+
+
+class Frame:
+    # A stage that has been entered but not yet left, on one thread.
+    __slots__ = ['name', 'wall', 'cpu', 'child_wall', 'child_cpu', 'rows', 'statements', 'peak_memory']
+
+    def __init__(self, name):
+        self.name = name
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        self.child_wall = 0.0
+        self.child_cpu = 0.0
+        self.rows = 0
+        self.statements = 0
+        self.peak_memory = 0
+
+
+class Profiler:
+    def __init__(self, memory=False):
+        self.start = time.perf_counter()
+        self.totals = {}
+        self.events = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stack(self):
+        try:
+            return self.local.stack
+        except AttributeError:
+            self.local.stack = []
+            return self.local.stack
+
+    def frame(self):
+        stack = self.stack()
+        return stack[-1] if stack else None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        stack = self.stack()
+        if self.memory:
+            # The peak is reset for the new stage, so the stage it is inside has to take note of it first
+            if stack:
+                stack[-1].peak_memory = max(stack[-1].peak_memory, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+        frame = Frame(name)
+        stack.append(frame)
+        try:
+            yield frame
+        finally:
+            stack.pop()
+            wall = time.perf_counter() - frame.wall
+            cpu = time.thread_time() - frame.cpu
+            if self.memory:
+                frame.peak_memory = max(frame.peak_memory, tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1].child_wall += wall
+                stack[-1].child_cpu += cpu
+                stack[-1].peak_memory = max(stack[-1].peak_memory, frame.peak_memory)
+            self.record(frame, wall, cpu)
+
+    def record(self, frame, wall, cpu):
+        with self.lock:
+            total = self.totals.setdefault(frame.name, {'stage': frame.name, 'calls': 0, 'wall_seconds': 0.0,
+                                                        'cpu_seconds': 0.0, 'rows': 0, 'statements': 0,
+                                                        'peak_memory': None})
+            total['calls'] += 1
+            total['wall_seconds'] += wall - frame.child_wall
+            total['cpu_seconds'] += cpu - frame.child_cpu
+            total['rows'] += frame.rows
+            total['statements'] += frame.statements
+            if self.memory:
+                total['peak_memory'] = max(total['peak_memory'] or 0, frame.peak_memory)
+
+            # In the Trace Event Format, which chrome://tracing and https://ui.perfetto.dev can display
+            self.events.append({'name': frame.name, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                                'ts': (frame.wall - self.start) * 1e6, 'dur': wall * 1e6,
+                                'args': {'rows': frame.rows, 'statements': frame.statements}})
+
+    def count(self, rows):
+        frame = self.frame()
+        if frame is not None:
+            frame.rows += rows
+
+    def statement(self, sql):
+        # sqlite3 calls this on the thread that runs the statement, i.e. the one whose stage it belongs to
+        frame = self.frame()
+        if frame is not None:
+            frame.statements += 1
+
+    def summary(self):
+        order = {name: i for i, name in enumerate(STAGES)}
+        return sorted(self.totals.values(), key=lambda i: (order.get(i['stage'], len(STAGES)), i['stage']))
+
+    def print_summary(self, file=sys.stderr):
+        print('%-10s %6s %9s %9s %11s %12s %8s %9s' % ('stage', 'calls', 'wall s', 'CPU s', 'rows', 'rows/sec',
+                                                      'SQL', 'peak MB'), file=file)
+        for i in self.summary():
+            print('%-10s %6d %9.3f %9.3f %11d %12s %8d %9s' % (
+                i['stage'], i['calls'], i['wall_seconds'], i['cpu_seconds'], i['rows'],
+                '%.0f' % (i['rows'] / i['wall_seconds']) if i['rows'] and i['wall_seconds'] else '-',
+                i['statements'], '-' if i['peak_memory'] is None else '%.1f' % (i['peak_memory'] / 1e6)), file=file)
+        print('%-10s %6s %9.3f' % ('total', '', time.perf_counter() - self.start), file=file)
+
+    def write_trace(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'stages': self.summary(), 'elapsed_seconds': time.perf_counter() - self.start,
+                       'traceEvents': self.events}, f, indent=1)
+
+
+def enable(memory=False):
+    global current
+    current = Profiler(memory)
+    return current
+
+def stage(name):
+    if current is None:
+        return DISABLED
+    return current.stage(name)
+
+def count(rows):
+    if current is not None:
+        current.count(rows)
+
+def trace(connection):
+    # Count the SQL statements run on connection. Only connections opened after enable() are counted.
+    if current is not None:
+        connection.set_trace_callback(current.statement)
+    return connection
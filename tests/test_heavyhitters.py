@@ -0,0 +1,94 @@
+# The Space-Saving summary: its counts are never too low, never more than their error too high, and add up to the
+# number of items counted.
+import collections
+import random
+import unittest
+import browserhandler
+import heavyhitters
+
+
+def skewed_stream(length, items, seed=0):
+    # A few items visited often and many visited rarely, as websites are
+    generator = random.Random(seed)
+    return ['site%d' % int(items ** generator.random()) for i in range(length)]
+
+
+class SpaceSavingTest(unittest.TestCase):
+    def test_capacity(self):
+        with self.assertRaises(ValueError):
+            heavyhitters.SpaceSaving(0)
+
+    def test_exact_while_not_full(self):
+        summary = heavyhitters.SpaceSaving(10)
+        summary.update(['a', 'b', 'a', 'c', 'a', 'b'])
+        self.assertEqual(summary.top(), [('a', 3, 0), ('b', 2, 0), ('c', 1, 0)])
+        self.assertEqual(summary.error_bound(), 0)
+        self.assertEqual(summary.total, 6)
+
+    def test_eviction(self):
+        # The newcomer takes over the smallest counter, count and all, and that count becomes its error
+        summary = heavyhitters.SpaceSaving(2)
+        for i in ['a', 'a', 'a', 'b', 'c']:
+            summary.add(i)
+        self.assertEqual(summary.top(), [('a', 3, 0), ('c', 2, 1)])
+        self.assertEqual(summary.error_bound(), 2)
+
+    def test_bounds(self):
+        stream = skewed_stream(50_000, 5_000)
+        true_counts = collections.Counter(stream)
+        capacity = 200
+        summary = heavyhitters.SpaceSaving(capacity)
+        summary.update(stream)
+
+        self.assertEqual(summary.total, len(stream))
+        self.assertEqual(sum(summary.counts.values()), len(stream))
+        self.assertLessEqual(len(summary.counts), capacity)
+        bound = summary.error_bound()
+        self.assertLessEqual(bound, len(stream) / capacity)
+        for item, count, error in summary.top():
+            self.assertLessEqual(error, bound)
+            self.assertGreaterEqual(count, true_counts[item])
+            self.assertLessEqual(count - error, true_counts[item])
+
+        # Anything visited more often than the bound is sure to have a counter
+        for item, count in true_counts.items():
+            if count > bound:
+                self.assertIn(item, summary.counts)
+
+    def test_chunks(self):
+        # Counting a stream in chunks keeps to the same bounds as counting one item at a time
+        stream = skewed_stream(30_000, 2_000, seed=1)
+        true_counts = collections.Counter(stream)
+        one_at_a_time = heavyhitters.SpaceSaving(100)
+        for i in stream:
+            one_at_a_time.add(i)
+        chunked = heavyhitters.SpaceSaving(100)
+        chunked.update(stream)
+        for summary in (one_at_a_time, chunked):
+            for item, count, error in summary.top():
+                self.assertTrue(count - error <= true_counts[item] <= count)
+        self.assertEqual([i[0] for i in one_at_a_time.top()[:5]], [i[0] for i in chunked.top()[:5]])
+
+    def test_counter(self):
+        # Items under the threshold, like those that lost their counters, end up in Everything Else
+        # (b, then c, lose their counters; d ends up with a count of 3, 2 of them c's and b's)
+        summary = heavyhitters.SpaceSaving(2)
+        for i in ['a'] * 5 + ['b', 'c', 'd']:
+            summary.add(i)
+        self.assertEqual(summary.top(), [('a', 5, 0), ('d', 3, 2)])
+        counts = summary.counter(threshold=4)
+        self.assertEqual(counts, collections.Counter({'a': 5, browserhandler.EVERYTHING_ELSE: 3}))
+
+    def test_counter_without_eviction(self):
+        summary = heavyhitters.SpaceSaving(4)
+        summary.update(['a'] * 5 + ['b'] * 3 + ['c'] * 2 + ['d'])
+        counts = summary.counter(threshold=3)
+        self.assertEqual(counts['a'], 5)
+        self.assertEqual(counts['b'], 3)
+        self.assertNotIn('c', counts)
+        self.assertEqual(counts[browserhandler.EVERYTHING_ELSE], 3)
+        self.assertEqual(sum(counts.values()), 11)
+
+
+if __name__ == '__main__':
+    unittest.main()
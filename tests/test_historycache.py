@@ -0,0 +1,265 @@
+# The cache: bringing it up to date from a browser's history (HistoryCache.update), and counting cached visits by
+# domain from the domain_days rollup (HistoryCache.count_domains), which has to count the visits on the partial days
+# at either end of a time window one by one.
+import collections
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import browserhandler
+import historycache
+
+DAY = 86400
+
+# Safari time of midnight UTC on the first day of the made-up history
+START = 700 * DAY
+
+
+class ListSource:
+    # A browser history made of a list of normalized rows, read as HistoryCache.update() reads a browser's
+    def __init__(self, path, rows):
+        self.path = path
+        self.rows = rows
+
+    def high_water(self):
+        return max((row[0] for row in self.rows), default=0)
+
+    def iter_visits(self, since_id=0):
+        yield [row for row in self.rows if row[0] > since_id]
+
+
+def visit(visit_id, url, time, counter=1):
+    return (visit_id, 'example.com', url, None, time, counter, 0)
+
+
+class UpdateTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = os.path.join(self.directory, 'History.db')
+        open(self.database, 'w').close()
+        self.source = ListSource(self.database, [visit(1, 'https://example.com/a', START),
+                                                 visit(2, 'https://example.com/b', START + 60)])
+        self.cache = historycache.HistoryCache(os.path.join(self.directory, 'cache.sqlite'))
+
+    def tearDown(self):
+        self.cache.connection.close()
+        shutil.rmtree(self.directory)
+
+    def cached(self):
+        # (visit_id, url, counter) of every cached visit
+        source_id = self.cache.update('test', 'test', self.source)
+        return [(row[0], row[2], row[5]) for batch in self.cache.iter_cached(source_id) for row in batch]
+
+    def high_water(self):
+        return self.cache.connection.execute('select high_water from sources').fetchone()[0]
+
+    def test_incremental(self):
+        self.assertEqual(self.cached(), [(1, 'https://example.com/a', 1), (2, 'https://example.com/b', 1)])
+        self.assertEqual(self.high_water(), 2)
+        self.source.rows.append(visit(3, 'https://example.com/c', START + 120))
+        self.assertEqual(self.cached(), [(1, 'https://example.com/a', 1), (2, 'https://example.com/b', 1),
+                                         (3, 'https://example.com/c', 1)])
+        self.assertEqual(self.high_water(), 3)
+
+    def test_only_new_visits_are_read(self):
+        self.cached()
+        read = []
+        iter_visits = self.source.iter_visits
+        self.source.iter_visits = lambda since_id=0: read.append(since_id) or iter_visits(since_id)
+        self.source.rows.append(visit(3, 'https://example.com/c', START + 120))
+        self.cached()
+        self.assertEqual(read, [2])
+
+    def test_counters(self):
+        # A new visit to a page brings the counts of the page's cached visits up to date
+        self.cached()
+        self.source.rows.append(visit(3, 'https://example.com/a', START + 120, counter=2))
+        self.assertEqual(self.cached(), [(1, 'https://example.com/a', 2), (2, 'https://example.com/b', 1),
+                                         (3, 'https://example.com/a', 2)])
+
+    def test_replaced_database(self):
+        # Another file in the database's place: what was cached from the old one is thrown away
+        self.cached()
+        replacement = os.path.join(self.directory, 'History.db.new')
+        open(replacement, 'w').close()
+        os.replace(replacement, self.database)
+        self.source.rows = [visit(1, 'https://example.com/x', START + 300)]
+        self.assertEqual(self.cached(), [(1, 'https://example.com/x', 1)])
+        self.assertEqual(self.high_water(), 1)
+
+    def test_cleared_history(self):
+        # The browser's largest visit ID is below the high-water mark: its history was cleared
+        self.source.rows.append(visit(3, 'https://example.com/c', START + 120))
+        self.cached()
+        self.source.rows = [visit(1, 'https://example.com/y', START + 400)]
+        self.assertEqual(self.cached(), [(1, 'https://example.com/y', 1)])
+        self.assertEqual(self.high_water(), 1)
+        self.assertEqual(self.cache.count_domains('test', 'test', self.source), {'example.com': 1})
+
+    def test_late_visits_from_a_browser(self):
+        # Visits that the browser only adds to the tables a query reads after a later visit has been cached must
+        # still be read: here, a Chrome-based browser's clusters_and_visits, which Vivaldi used to be read through.
+        browser = os.path.join(self.directory, 'Vivaldi')
+        os.mkdir(browser)
+        connection = sqlite3.connect(os.path.join(browser, 'History'))
+        connection.executescript('''
+            create table urls (id integer primary key, url text, title text, visit_count integer);
+            create table visits (id integer primary key, url integer, visit_time integer, visit_duration integer);
+            create table clusters_and_visits (cluster_id integer, visit_id integer, url_for_deduping text,
+                url_for_display text);
+            insert into urls values (1, 'https://example.com/', 'Example', 2);
+            insert into visits values (9001, 1, 13300000000000000, 0), (9002, 1, 13300000001000000, 0);
+            insert into clusters_and_visits values (1, 9002, 'https://example.com/', 'example.com/');
+        ''')
+        connection.commit()
+        profile = browserhandler.VivaldiProfile(browser)
+        source_id = self.cache.update('vivaldi', 'test', profile)
+        connection.execute("insert into clusters_and_visits values (1, 9001, 'https://example.com/', 'example.com/')")
+        connection.commit()
+        connection.close()
+        profile.discard_snapshot()
+        self.cache.update('vivaldi', 'test', profile)
+        self.assertEqual([row[0] for batch in self.cache.iter_cached(source_id) for row in batch], [9001, 9002])
+
+
+@unittest.skipUnless(sqlite3.connect(':memory:').execute("select sqlite_compileoption_used('ENABLE_FTS5')")
+                     .fetchone()[0], 'SQLite was built without FTS5')
+class SearchTest(unittest.TestCase):
+    # The same page visited in two browsers, as with browser sync, and once more in the second a minute later
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = historycache.HistoryCache(os.path.join(self.directory, 'cache.sqlite'))
+        self.source_ids = []
+        for name, rows in [('a', [visit(1, 'https://example.com/python', START)]),
+                           ('b', [visit(1, 'https://example.com/python', START + 0.5),
+                                  visit(2, 'https://example.com/python', START + 60),
+                                  visit(3, 'https://example.com/other', START + 120)])]:
+            database = os.path.join(self.directory, name + '.db')
+            open(database, 'w').close()
+            self.source_ids.append(self.cache.update('test', name, ListSource(database, rows)))
+
+    def tearDown(self):
+        self.cache.connection.close()
+        shutil.rmtree(self.directory)
+
+    def search(self, text, **options):
+        # (profile, visit_id) of each result
+        return [(row[1], row[2]) for row in self.cache.search(text, self.source_ids, **options)]
+
+    def test_search(self):
+        self.assertEqual(self.search('python'), [('b', 2), ('b', 1), ('a', 1)])
+        self.assertEqual(self.search('other'), [('b', 3)])
+        self.assertEqual(self.search('python', limit=1), [('b', 2)])
+
+    def test_time_window(self):
+        since = START + 30 + browserhandler.SAFARI_EPOCH
+        self.assertEqual(self.search('python', since=since), [('b', 2)])
+        self.assertEqual(self.search('python', until=since), [('b', 1), ('a', 1)])
+
+    def test_duplicates(self):
+        # With window, the visit recorded second is left out, but only if the first is searched as well
+        self.assertEqual(self.search('python', window=1.0), [('b', 2), ('a', 1)])
+        self.assertEqual(self.search('python', window=1.0, since=START + 0.25 + browserhandler.SAFARI_EPOCH),
+                         [('b', 2), ('b', 1)])
+        self.assertEqual(self.search('python', window=0.25), [('b', 2), ('b', 1), ('a', 1)])
+
+
+def expected_counts(rows, since=None, until=None, threshold=0):
+    # The counts count_domains should return, worked out one visit at a time
+    counts = collections.Counter()
+    for visit_id, domain, url, title, time, counter, duration in rows:
+        unix_time = time + browserhandler.SAFARI_EPOCH
+        if domain is None or (since is not None and unix_time < since) or (until is not None and unix_time >= until):
+            continue
+        counts[domain] += 1
+    result = collections.Counter()
+    for domain, visits in counts.items():
+        result[domain if visits >= threshold else browserhandler.EVERYTHING_ELSE] += visits
+    return result
+
+
+class CountDomainsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        generator = random.Random(0)
+        self.rows = []
+        for i in range(3000):
+            domain = generator.choice(['a.com', 'b.org', 'c.net', 'd.de', None])
+            time = START + generator.random() * 10 * DAY
+            self.rows.append((i + 1, domain, 'https://%s/%d' % (domain, i), None, time, 1, 0))
+        # A visit exactly at midnight, on the edge of a day
+        self.rows.append((len(self.rows) + 1, 'a.com', 'https://a.com/midnight', None, START + 3 * DAY, 1, 0))
+
+        database = os.path.join(self.directory, 'History.db')
+        open(database, 'w').close()
+        self.source = ListSource(database, self.rows)
+        self.cache = historycache.HistoryCache(os.path.join(self.directory, 'cache.sqlite'))
+
+    def tearDown(self):
+        self.cache.connection.close()
+        shutil.rmtree(self.directory)
+
+    def count(self, since=None, until=None, threshold=0):
+        return self.cache.count_domains('test', 'test', self.source, since=since, until=until, threshold=threshold)
+
+    def unix(self, safari_time):
+        return safari_time + browserhandler.SAFARI_EPOCH
+
+    def test_everything(self):
+        self.assertEqual(self.count(), expected_counts(self.rows))
+
+    def test_whole_days(self):
+        since, until = self.unix(START + 2 * DAY), self.unix(START + 5 * DAY)
+        self.assertEqual(self.count(since, until), expected_counts(self.rows, since, until))
+
+    def test_partial_days(self):
+        since, until = self.unix(START + 2.25 * DAY), self.unix(START + 7.5 * DAY)
+        self.assertEqual(self.count(since, until), expected_counts(self.rows, since, until))
+
+    def test_within_one_day(self):
+        since, until = self.unix(START + 4.1 * DAY), self.unix(START + 4.9 * DAY)
+        self.assertEqual(self.count(since, until), expected_counts(self.rows, since, until))
+
+    def test_across_one_midnight(self):
+        # Not one whole day in the window, though it spans two
+        since, until = self.unix(START + 2.5 * DAY), self.unix(START + 3.5 * DAY)
+        self.assertEqual(self.count(since, until), expected_counts(self.rows, since, until))
+
+    def test_midnight_edges(self):
+        # The visit at midnight belongs to the window that starts then, not the one that ends then
+        midnight = self.unix(START + 3 * DAY)
+        self.assertEqual(self.count(midnight - 0.5 * DAY, midnight), expected_counts(self.rows, midnight - 0.5 * DAY,
+                                                                                     midnight))
+        self.assertEqual(self.count(midnight, midnight + 0.5 * DAY), expected_counts(self.rows, midnight,
+                                                                                     midnight + 0.5 * DAY))
+
+    def test_open_ended(self):
+        since = self.unix(START + 6.3 * DAY)
+        self.assertEqual(self.count(since=since), expected_counts(self.rows, since=since))
+        until = self.unix(START + 1.7 * DAY)
+        self.assertEqual(self.count(until=until), expected_counts(self.rows, until=until))
+
+    def test_random_windows(self):
+        generator = random.Random(1)
+        for i in range(50):
+            since, until = sorted(self.unix(START + generator.uniform(-DAY, 11 * DAY)) for j in range(2))
+            self.assertEqual(self.count(since, until), expected_counts(self.rows, since, until))
+
+    def test_threshold(self):
+        since, until = self.unix(START + 1.5 * DAY), self.unix(START + 2.5 * DAY)
+        counts = expected_counts(self.rows, since, until)
+        threshold = sorted(counts.values())[len(counts) // 2]
+        self.assertEqual(self.count(since, until, threshold), expected_counts(self.rows, since, until, threshold))
+
+    def test_new_visits(self):
+        # Visits added since the last update are counted too
+        since, until = self.unix(START + 0.5 * DAY), self.unix(START + 12.5 * DAY)
+        self.count(since, until)
+        self.rows.append((len(self.rows) + 1, 'e.fr', 'https://e.fr/', None, START + 10.5 * DAY, 1, 0))
+        self.assertEqual(self.count(since, until), expected_counts(self.rows, since, until))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+# Merging several sources' visits into one timeline (browserhandler.merge_timelines), as -w all does, and leaving
+# the same visits out of the server's history (historyserver.LiveHistory).
+import os
+import shutil
+import tempfile
+import unittest
+import browserhandler
+import historyserver
+
+
+def visit(visit_id, url, time):
+    # A normalized row
+    return (visit_id, 'example.com', url, None, time, 1, 0)
+
+def merge(streams, **options):
+    # The merged timeline as a list of (browser, profile, visit_id)
+    return [(browser, profile, row[0]) for batch in browserhandler.merge_timelines(streams, **options)
+            for browser, profile, row in batch]
+
+
+class MergeTimelinesTest(unittest.TestCase):
+    def test_order(self):
+        a = [[visit(1, 'https://example.com/1', 10.0), visit(2, 'https://example.com/2', 30.0)]]
+        b = [[visit(1, 'https://example.com/3', 20.0)], [visit(2, 'https://example.com/4', 40.0)]]
+        self.assertEqual(merge([('safari', None, a), ('firefox', 'x', b)]),
+                         [('safari', None, 1), ('firefox', 'x', 1), ('safari', None, 2), ('firefox', 'x', 2)])
+
+    def test_duplicates_across_sources(self):
+        # The same page in two sources within the window is one visit, kept from whichever recorded it first
+        a = [[visit(1, 'https://example.com/', 10.0)]]
+        b = [[visit(7, 'https://example.com/', 10.5)]]
+        self.assertEqual(merge([('safari', None, a), ('firefox', 'x', b)]), [('safari', None, 1)])
+
+    def test_outside_window(self):
+        a = [[visit(1, 'https://example.com/', 10.0)]]
+        b = [[visit(7, 'https://example.com/', 11.5)]]
+        self.assertEqual(merge([('safari', None, a), ('firefox', 'x', b)]), [('safari', None, 1), ('firefox', 'x', 7)])
+
+    def test_other_pages(self):
+        a = [[visit(1, 'https://example.com/a', 10.0)]]
+        b = [[visit(7, 'https://example.com/b', 10.0)]]
+        self.assertEqual(len(merge([('safari', None, a), ('firefox', 'x', b)])), 2)
+
+    def test_same_source(self):
+        # A page visited twice in quick succession in one source is two visits, unless it is the same visit twice
+        a = [[visit(1, 'https://example.com/', 10.0), visit(2, 'https://example.com/', 10.2),
+              visit(2, 'https://example.com/', 10.2)]]
+        self.assertEqual(merge([('safari', None, a)]), [('safari', None, 1), ('safari', None, 2)])
+
+    def test_window_eviction(self):
+        # Visits only count as duplicates of those still within the window: firefox's visit at 11.5 is over a second
+        # after safari's first but not its second, and its visit at 13.0 is over a second after both.
+        a = [[visit(1, 'https://example.com/', 10.0), visit(2, 'https://example.com/', 10.8)]]
+        b = [[visit(7, 'https://example.com/', 11.5), visit(8, 'https://example.com/', 13.0)]]
+        self.assertEqual(merge([('safari', None, a), ('firefox', 'x', b)]),
+                         [('safari', None, 1), ('safari', None, 2), ('firefox', 'x', 8)])
+
+    def test_window(self):
+        a = [[visit(1, 'https://example.com/', 10.0)]]
+        b = [[visit(7, 'https://example.com/', 14.0)]]
+        self.assertEqual(merge([('safari', None, a), ('firefox', 'x', b)], window=5.0), [('safari', None, 1)])
+
+    def test_batches(self):
+        a = [[visit(i, 'https://example.com/%d' % i, float(i)) for i in range(5)]]
+        timeline = list(browserhandler.merge_timelines([('safari', None, a)], batch_size=2))
+        self.assertEqual([len(i) for i in timeline], [2, 2, 1])
+
+    def test_split_timeline(self):
+        a = [[visit(1, 'https://example.com/1', 10.0), visit(2, 'https://example.com/2', 11.0)]]
+        b = [[visit(1, 'https://example.com/3', 20.0)]]
+        runs = list(browserhandler.split_timeline(browserhandler.merge_timelines([('safari', None, a),
+                                                                                 ('firefox', 'x', b)])))
+        self.assertEqual([(browser, profile, [len(i) for i in batches]) for browser, profile, batches in runs],
+                         [('safari', None, [2]), ('firefox', 'x', [1])])
+
+
+class ListSource:
+    # A browser history made of a list of normalized rows, in a file that is written to whenever a row is added
+    def __init__(self, path, rows):
+        self.path = path
+        self.rows = []
+        self.add(*rows)
+
+    def add(self, *rows):
+        self.rows += rows
+        with open(self.path, 'a') as f:
+            f.write('.' * len(rows))
+
+    def high_water(self):
+        return max((row[0] for row in self.rows), default=0)
+
+    def iter_visits(self, since_id=0, since=None, by_time=False):
+        rows = [row for row in self.rows if row[0] > since_id]
+        yield sorted(rows, key=lambda row: row[4]) if by_time else rows
+
+    def discard_snapshot(self):
+        pass
+
+
+class LiveHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.a = ListSource(os.path.join(self.directory, 'a'), [visit(1, 'https://example.com/', 10.0),
+                                                                visit(2, 'https://example.com/2', 20.0)])
+        self.b = ListSource(os.path.join(self.directory, 'b'), [visit(1, 'https://example.com/', 10.5),
+                                                                visit(2, 'https://example.com/', 30.0)])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def history(self, deduplicate):
+        return historyserver.LiveHistory({('a', None): self.a, ('b', None): self.b}, deduplicate=deduplicate)
+
+    def visits(self, history):
+        return [(visit['browser'], visit['visits'], visit['high_water']) for visit in history.summary()]
+
+    def test_load(self):
+        self.assertEqual(self.visits(self.history(False)), [('a', 2, 2), ('b', 2, 2)])
+        self.assertEqual(self.visits(self.history(True)), [('a', 2, 2), ('b', 1, 2)])
+
+    def test_refresh(self):
+        # New visits are left out if the other source already has them, even from before them
+        history = self.history(True)
+        self.a.add(visit(3, 'https://example.com/3', 40.0))
+        self.b.add(visit(3, 'https://example.com/3', 40.2), visit(4, 'https://example.com/2', 25.0))
+        self.assertEqual(history.refresh(), 2)
+        self.b.add(visit(5, 'https://example.com/4', 50.0))
+        self.assertEqual(history.refresh(), 1)
+        self.a.add(visit(4, 'https://example.com/4', 49.5))
+        self.assertEqual(history.refresh(), 0)
+        self.assertEqual(self.visits(history), [('a', 3, 4), ('b', 3, 5)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+# visittable.py
+# A compact, column-oriented store for browser history.
+#
+# 10/17/26: history used to be held as {domain: [VisitContainer, ...]}, i.e. one full Python object (with its own
+# __dict__) per visit. For histories of millions of visits, those objects took up most of the memory and most of the
+# garbage collector's time. A VisitTable instead keeps each field in a typed array, one slot per visit, and stores
+# each distinct domain, URL and title only once, in a pool; the arrays hold the position of the string in its pool.
+# A VisitTable still behaves like the old mapping (see DomainVisits below), so existing code such as chartgen keeps
+# working unchanged.
+from array import array
+from collections.abc import Mapping, Sequence
+import sys
+import browserhandler
+
+
+class StringPool:
+    # Hands out a small integer for each distinct string (or None), and gives the string back for that integer.
+    def __init__(self):
+        self.values = []
+        self.index = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def intern(self, value):
+        try:
+            return self.index[value]
+        except KeyError:
+            self.index[value] = len(self.values)
+            self.values.append(value)
+            return len(self.values) - 1
+
+    def copy(self):
+        pool = StringPool()
+        pool.values = list(self.values)
+        pool.index = dict(self.index)
+        return pool
+
+    def memory_usage(self):
+        return (sys.getsizeof(self.values) + sys.getsizeof(self.index)
+                + sum(sys.getsizeof(i) for i in self.values if i is not None))
+
+
+class DomainVisits(Sequence):
+    # The visits to one domain, presented as the list of VisitContainers that used to be stored for it.
+    # Containers are only built as they are asked for, and nothing at all is needed to take its len().
+    def __init__(self, table, domain_id):
+        self.table = table
+        self.domain_id = domain_id
+
+    @property
+    def rows(self):
+        return self.table.domain_rows(self.domain_id)
+
+    def __len__(self):
+        return self.table.domain_counts[self.domain_id]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.table.visit(i) for i in self.rows[index]]
+        return self.table.visit(self.rows[index])
+
+
+class VisitTable(Mapping):
+    # Columns, all of equal length; the n-th entry of each describes the n-th visit.
+    #    visit_ids: the browser's own ID for the visit
+    #    domain_ids, url_ids, title_ids: positions in the domains, urls and titles pools respectively
+    #    times: Safari time (seconds since midnight UTC on 1 January 2001)
+    #    counters: the number of visits to the URL, as reported by the browser
+    #    durations: the length of the visit, where known (0 otherwise)
+    #    source_ids: which of the browser profiles the table was read from recorded the visit, numbered from 0 (see
+    #       browserhandler.merge_visits), so that each profile's visits can be told apart once they are combined
+    def __init__(self, rows=()):
+        self.visit_ids = array('q')
+        self.domain_ids = array('i')
+        self.url_ids = array('i')
+        self.title_ids = array('i')
+        self.times = array('d')
+        self.counters = array('q')
+        self.durations = array('q')
+        self.source_ids = array('i')
+
+        self.domains = StringPool()
+        self.urls = StringPool()
+        self.titles = StringPool()
+
+        # Number of visits per domain, indexed by domain ID; this keeps len(table[domain]) cheap.
+        self.domain_counts = array('q')
+        self.maximum_counter = -1
+        self.maximum_duration = -1
+        self.__rows_by_domain = None
+
+        self.extend(rows)
+
+    def append(self, visit_id, domain, url, title, time, counter, duration, source=0):
+        domain_id = self.domains.intern(domain)
+        if domain_id == len(self.domain_counts):
+            self.domain_counts.append(0)
+        self.domain_counts[domain_id] += 1
+
+        self.visit_ids.append(visit_id)
+        self.domain_ids.append(domain_id)
+        self.url_ids.append(self.urls.intern(url))
+        self.title_ids.append(self.titles.intern(title))
+        self.times.append(time)
+        self.counters.append(counter or 0)
+        self.durations.append(duration or 0)
+        self.source_ids.append(source)
+
+        if counter is not None and counter > self.maximum_counter:
+            self.maximum_counter = counter
+
+        if duration is not None and duration > self.maximum_duration:
+            self.maximum_duration = duration
+
+        self.__rows_by_domain = None
+
+    def extend(self, rows, source=0):
+        # rows are normalized visit tuples, as described in browserhandler.py, all from the same source
+        for row in rows:
+            self.append(*row, source=source)
+
+    def rows(self):
+        # The table's contents as normalized visit tuples, in the order they were added.
+        for i in range(len(self.visit_ids)):
+            yield (self.visit_ids[i], self.domains.values[self.domain_ids[i]], self.urls.values[self.url_ids[i]],
+                   self.titles.values[self.title_ids[i]], self.times[i], self.counters[i], self.durations[i])
+
+    def visit(self, row):
+        return browserhandler.VisitContainer(
+            self.urls.values[self.url_ids[row]],
+            self.titles.values[self.title_ids[row]],
+            self.times[row],
+            self.counters[row],
+            self.durations[row]
+        )
+
+    def row_count(self):
+        return len(self.visit_ids)
+
+    def domain_rows(self, domain_id):
+        # Positions of every visit to each domain, built in one pass the first time a domain's visits are needed.
+        if self.__rows_by_domain is None:
+            self.__rows_by_domain = [array('i') for i in range(len(self.domains))]
+            for row, i in enumerate(self.domain_ids):
+                self.__rows_by_domain[i].append(row)
+        return self.__rows_by_domain[domain_id]
+
+    # Mapping interface: domain -> visits to that domain
+    def __getitem__(self, domain):
+        try:
+            domain_id = self.domains.index[domain]
+        except KeyError:
+            raise KeyError(domain) from None
+        return DomainVisits(self, domain_id)
+
+    def __iter__(self):
+        return iter(self.domains.values)
+
+    def __len__(self):
+        return len(self.domains)
+
+    def __contains__(self, domain):
+        return domain in self.domains.index
+
+    def memory_usage(self):
+        # Approximate size of the table in bytes, pools included.
+        columns = (self.visit_ids, self.domain_ids, self.url_ids, self.title_ids, self.times, self.counters,
+                   self.durations, self.source_ids, self.domain_counts)
+        return (sum(i.itemsize * len(i) for i in columns)
+                + self.domains.memory_usage() + self.urls.memory_usage() + self.titles.memory_usage())
+
+    def bytes_per_visit(self):
+        if self.row_count() == 0:
+            return 0
+        return self.memory_usage() / self.row_count()
+
+
+def container_memory_usage(entries):
+    # Approximate size in bytes of history held the old way, as {domain: [VisitContainer, ...]}; this is the figure
+    # to compare VisitTable.memory_usage() against. Strings shared between visits are only counted once.
+    total = sys.getsizeof(entries)
+    seen = set()
+    for domain, visits in entries.items():
+        total += sys.getsizeof(domain) + sys.getsizeof(visits)
+        for i in visits:
+            total += sys.getsizeof(i) + sys.getsizeof(i.__dict__)
+            for value in i.__dict__.values():
+                if id(value) not in seen:
+                    seen.add(id(value))
+                    total += sys.getsizeof(value)
+    return total